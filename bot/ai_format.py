@@ -0,0 +1,184 @@
+"""
+Оформление текстов через OpenAI-совместимый API.
+
+- один клиент на процесс (и на event loop), пул соединений переиспользуется;
+- не больше AI_CONCURRENCY запросов одновременно, у каждого — таймаут AI_TIMEOUT;
+- результат кэшируется в SQLite (ai_cache) по sha256(prompt, model, текст):
+  одинаковые тексты (перепечатки одной новости) форматируются один раз,
+  одинаковые запросы «в полёте» объединяются; записи старше AI_CACHE_DAYS удаляются (prune_cache);
+- circuit breaker: после AI_BREAKER_FAILS ошибок подряд API не трогаем AI_BREAKER_COOLDOWN секунд.
+OPENAI_BASE_URL позволяет направить клиент на локальную заглушку (тесты, self-hosted модели).
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from .db import afetchone, aexecute, awrite, execute, get_setting
+
+try:
+    from openai import AsyncOpenAI
+except Exception:  # pragma: no cover - fallback if lib missing
+    AsyncOpenAI = None
+
+log = logging.getLogger(__name__)
+
+AI_CONCURRENCY = max(1, int(os.getenv("AI_CONCURRENCY", "4")))
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "30"))
+AI_MAX_RETRIES = max(0, int(os.getenv("AI_MAX_RETRIES", "1")))
+AI_BREAKER_FAILS = max(1, int(os.getenv("AI_BREAKER_FAILS", "5")))
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "120"))
+AI_CACHE_DAYS = max(1, int(os.getenv("AI_CACHE_DAYS", "30")))
+_PRUNE_EVERY_SEC = 3600.0
+
+
+class AIUnavailable(RuntimeError):
+    """API выключен circuit breaker'ом — запрос не отправлялся."""
+
+
+def _model() -> str:
+    return os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+def cache_key(prompt: str, model: str, text: str) -> str:
+    h = hashlib.sha256()
+    for p in (prompt, model, text):
+        h.update(p.encode("utf-8", errors="ignore"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+class _Breaker:
+    def __init__(self):
+        self.fails = 0
+        self.open_until = 0.0
+
+    def allow(self) -> bool:
+        # по истечении паузы пропускаем запросы снова (пробные), первая же ошибка вновь откроет
+        return time.monotonic() >= self.open_until
+
+    def success(self):
+        self.fails = 0
+        self.open_until = 0.0
+
+    def failure(self):
+        self.fails += 1
+        if self.fails >= AI_BREAKER_FAILS:
+            self.open_until = time.monotonic() + AI_BREAKER_COOLDOWN
+            log.warning("AI breaker open for %.0fs after %d failures", AI_BREAKER_COOLDOWN, self.fails)
+
+
+_client = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_sem: Optional[asyncio.Semaphore] = None
+_inflight: Dict[str, asyncio.Future] = {}
+_breaker = _Breaker()
+_last_prune = 0.0
+
+def _get_client(api_key: str):
+    """Клиент и семафор привязаны к event loop — пересоздаём, если loop сменился."""
+    global _client, _client_loop, _sem
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            timeout=AI_TIMEOUT,
+            max_retries=AI_MAX_RETRIES,
+        )
+        _client_loop = loop
+        _sem = asyncio.Semaphore(AI_CONCURRENCY)
+        _inflight.clear()
+    return _client
+
+async def aclose():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.close()
+    _client = _client_loop = None
+
+
+def available() -> bool:
+    """False — circuit breaker открыт, запросы к API сейчас не отправляются."""
+    return _breaker.allow()
+
+
+async def _call(client, prompt: str, model: str, text: str) -> str:
+    async with _sem:
+        # проверяем уже после семафора: очередь ждущих не должна проскочить открывшийся breaker
+        if not _breaker.allow():
+            raise AIUnavailable("AI temporarily disabled (circuit breaker)")
+        try:
+            # wait_for — страховка поверх таймаута клиента (ретраи суммируются)
+            resp = await asyncio.wait_for(
+                client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": prompt},
+                        {"role": "user", "content": text},
+                    ],
+                ),
+                timeout=AI_TIMEOUT * (AI_MAX_RETRIES + 1),
+            )
+            out = (resp.choices[0].message.content or "").strip()
+            if not out:
+                raise ValueError("empty AI response")
+        except Exception:
+            _breaker.failure()
+            raise
+    _breaker.success()
+    return out
+
+
+def prune_cache() -> int:
+    """Удалить из ai_cache записи старше AI_CACHE_DAYS. Возвращает число удалённых."""
+    cur = execute("DELETE FROM ai_cache WHERE created_at < datetime('now', ?)", (f"-{AI_CACHE_DAYS} days",))
+    return cur.rowcount
+
+async def maybe_prune_cache() -> int:
+    """prune_cache не чаще раза в _PRUNE_EVERY_SEC — вызывается из каждого прохода обогащения."""
+    global _last_prune
+    now = time.monotonic()
+    if _last_prune and now - _last_prune < _PRUNE_EVERY_SEC:
+        return 0
+    _last_prune = now
+    removed = await awrite(prune_cache)
+    if removed:
+        log.info("AI cache: removed %d entries older than %d days", removed, AI_CACHE_DAYS)
+    return removed
+
+
+async def format_text(text: str, strict: bool = False) -> str:
+    """
+    Оформить текст по AI_PROMPT из настроек. Без промпта/ключа/библиотеки — текст как есть.
+    strict=True — ошибку API пробрасываем, иначе возвращаем исходный текст.
+    """
+    prompt = (get_setting("AI_PROMPT") or "").strip()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not prompt or not api_key or AsyncOpenAI is None:
+        return text
+    client = _get_client(api_key)
+    model = _model()
+    key = cache_key(prompt, model, text)
+
+    row = await afetchone("SELECT output FROM ai_cache WHERE key=?", (key,))
+    if row:
+        return row[0]
+
+    fut = _inflight.get(key)
+    if fut is None:
+        fut = _inflight[key] = asyncio.ensure_future(_call(client, prompt, model, text))
+        fut.add_done_callback(lambda f: _inflight.pop(key, None))
+    try:
+        out = await asyncio.shield(fut)
+    except Exception as e:
+        log.warning("AI format failed: %s", e)
+        if strict:
+            raise
+        return text
+    await aexecute(
+        "INSERT OR IGNORE INTO ai_cache(key, model, output) VALUES (?,?,?)",
+        (key, model, out),
+    )
+    return out
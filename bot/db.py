@@ -1,96 +1,289 @@
-
-import os, sqlite3
-from contextlib import closing
+import os, re, sys, sqlite3, threading, asyncio, time, logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from .config import get_config
+from .migrations import migrate, backfill_fts_batch
 
+log = logging.getLogger(__name__)
 cfg = get_config()
 DB_PATH = os.path.join(cfg.data_dir, "bot.db")
 
-def _table_exists(con, name: str) -> bool:
-    try:
-        return con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
-    except Exception:
-        return False
+# PRAGMA применяются один раз при открытии соединения, дальше соединение живёт в потоке
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
 
-def _col_names(con, table: str):
-    try:
-        return [r[1] for r in con.execute(f"PRAGMA table_info({table})").fetchall()]
-    except Exception:
-        return []
+# Асинхронный слой: один поток-писатель (записи сериализуются) и несколько читателей
+DB_READERS = max(1, int(os.getenv("DB_READERS", "4")))
 
-def init_db():
-    os.makedirs(cfg.data_dir, exist_ok=True)
-    with closing(sqlite3.connect(DB_PATH)) as con:
-        # базовые PRAGMA
+# Кэш settings: 0 — без устаревания; >0 — перечитывать раз в N секунд (правки из другого процесса)
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "0"))
+
+# Инструментирование запросов: счётчики/гистограммы по нормализованному SQL + лог медленных
+DB_STATS = os.getenv("DB_STATS", "1").lower() not in {"0", "false", "no", "off"}
+DB_SLOW_MS = float(os.getenv("DB_SLOW_MS", "200"))
+
+_local = threading.local()
+_all_cons: list[sqlite3.Connection] = []
+_all_lock = threading.Lock()
+
+def _open() -> sqlite3.Connection:
+    # isolation_level=None — autocommit: каждый execute фиксируется сразу, без отдельного commit()
+    con = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+    for p in _PRAGMAS:
         try:
-            con.execute("PRAGMA journal_mode=WAL")
-            con.execute("PRAGMA foreign_keys=ON")
+            con.execute(p)
         except Exception:
             pass
+    return con
+
+def get_con() -> sqlite3.Connection:
+    """Долгоживущее соединение текущего потока (одно на поток, переиспользуется)."""
+    con = getattr(_local, "con", None)
+    if con is None or getattr(_local, "path", None) != DB_PATH:
+        con = _open()
+        _local.con, _local.path = con, DB_PATH
+        with _all_lock:
+            _all_cons.append(con)
+    return con
+
+_writer: ThreadPoolExecutor | None = None
+_readers: ThreadPoolExecutor | None = None
+
+def _pools() -> tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+    global _writer, _readers
+    if _writer is None or _readers is None:
+        with _all_lock:
+            if _writer is None:
+                _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+            if _readers is None:
+                _readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-reader")
+    return _writer, _readers
+
+def close_all():
+    """Остановить потоки БД и закрыть все открытые соединения (при остановке процесса)."""
+    global _writer, _readers
+    for pool in (_writer, _readers):
+        if pool is not None:
+            pool.shutdown(wait=True)
+    _writer = _readers = None
+    with _all_lock:
+        cons = list(_all_cons)
+        _all_cons.clear()
+    for con in cons:
+        try:
+            con.close()
+        except Exception:
+            pass
+    _local.__dict__.clear()
+
+def init_db():
+    """Создать/обновить схему. На актуальной базе — одно чтение PRAGMA user_version."""
+    os.makedirs(cfg.data_dir, exist_ok=True)
+    migrate(get_con())
+    load_settings()
+
+# ---- инструментирование ----
+_HIST_MS = (1, 5, 10, 50, 100, 500, 1000)  # верхние границы корзин; последняя корзина — «больше»
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_PARAM_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_SKIP_MODULES = (__name__, "asyncio", "concurrent.futures", "threading", "contextlib")
+
+class _QueryStat:
+    __slots__ = ("count", "total", "max", "hist")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.hist = [0] * (len(_HIST_MS) + 1)
+
+_stats: dict[str, _QueryStat] = {}
+_stats_lock = threading.Lock()
+_norm_cache: dict[str, str] = {}
+
+def _normalize(sql: str) -> str:
+    key = _norm_cache.get(sql)
+    if key is None:
+        key = " ".join(sql.split())
+        key = _SQL_LITERAL.sub("?", key)
+        key = _SQL_PARAM_LIST.sub("?…", key)
+        if len(_norm_cache) < 4096:
+            _norm_cache[sql] = key
+    return key
 
-        # ---- pre-migration: добавим недостающие колонки, если база уже существовала ----
-        if _table_exists(con, "feeds"):
-            cols = _col_names(con, "feeds")
-            if "etag" not in cols:
-                try: con.execute("ALTER TABLE feeds ADD COLUMN etag TEXT")
-                except Exception: pass
-            if "last_modified" not in cols:
-                try: con.execute("ALTER TABLE feeds ADD COLUMN last_modified TEXT")
-                except Exception: pass
-
-        if _table_exists(con, "feed_entries"):
-            cols = _col_names(con, "feed_entries")
-            if "hash" not in cols:
-                # используется в уникальном индексе uq_feed_entries_hash
-                try: con.execute("ALTER TABLE feed_entries ADD COLUMN hash TEXT")
-                except Exception: pass
-
-        if _table_exists(con, "drafts"):
-            cols = _col_names(con, "drafts")
-            if "hash" not in cols:
-                try: con.execute("ALTER TABLE drafts ADD COLUMN hash TEXT")
-                except Exception: pass
-            if "media_url" not in cols:
-                try: con.execute("ALTER TABLE drafts ADD COLUMN media_url TEXT")
-                except Exception: pass
-            if "source_url" not in cols:
-                try: con.execute("ALTER TABLE drafts ADD COLUMN source_url TEXT")
-                except Exception: pass
-
-        if _table_exists(con, "draft_meta"):
-            cols = _col_names(con, "draft_meta")
-            if "hash" not in cols:
-                try: con.execute("ALTER TABLE draft_meta ADD COLUMN hash TEXT")
-                except Exception: pass
-            if "media_url" not in cols:
-                try: con.execute("ALTER TABLE draft_meta ADD COLUMN media_url TEXT")
-                except Exception: pass
-
-        # ---- основная схема ----
-        models_path = os.path.join(os.path.dirname(__file__), "models.sql")
-        with open(models_path, "r", encoding="utf-8") as f:
-            con.executescript(f.read())
-        con.commit()
+def _caller() -> str:
+    """Первый кадр стека вне слоя БД — обычно хендлер или воркер."""
+    f = sys._getframe(1)
+    while f is not None:
+        mod = f.f_globals.get("__name__", "")
+        if not mod.startswith(_SKIP_MODULES):
+            return f"{mod}.{f.f_code.co_name}"
+        f = f.f_back
+    return "?"
 
+def _record(sql: str, elapsed: float):
+    ms = elapsed * 1000.0
+    key = _normalize(sql)
+    i = 0
+    while i < len(_HIST_MS) and ms > _HIST_MS[i]:
+        i += 1
+    with _stats_lock:
+        st = _stats.get(key)
+        if st is None:
+            st = _stats[key] = _QueryStat()
+        st.count += 1
+        st.total += ms
+        if ms > st.max:
+            st.max = ms
+        st.hist[i] += 1
+    if ms >= DB_SLOW_MS:
+        log.warning("slow query %.1f ms [%s]: %s", ms, getattr(_local, "caller", None) or _caller(), key)
+
+def _timed(sql: str, fn, *args):
+    if not DB_STATS:
+        return fn(*args)
+    t0 = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        _record(sql, time.perf_counter() - t0)
+
+def query_stats(limit: int | None = None) -> list[dict]:
+    """Снимок статистики, самые дорогие (по суммарному времени) — первыми."""
+    with _stats_lock:
+        items = [(k, st.count, st.total, st.max, list(st.hist)) for k, st in _stats.items()]
+    items.sort(key=lambda x: x[2], reverse=True)
+    labels = [f"<={b}ms" for b in _HIST_MS] + [f">{_HIST_MS[-1]}ms"]
+    out = [{
+        "sql": k,
+        "count": count,
+        "total_ms": round(total, 3),
+        "avg_ms": round(total / count, 3) if count else 0.0,
+        "max_ms": round(mx, 3),
+        "hist": dict(zip(labels, hist)),
+    } for k, count, total, mx, hist in items]
+    return out[:limit] if limit else out
+
+def reset_query_stats():
+    with _stats_lock:
+        _stats.clear()
+
+# ---- sync API ----
 def execute(sql: str, params: tuple = ()):
-    with closing(sqlite3.connect(DB_PATH)) as con:
-        cur = con.execute(sql, params)
-        con.commit()
-        return cur
+    return _timed(sql, get_con().execute, sql, params)
+
+def executemany(sql: str, seq_of_params):
+    return _timed(sql, get_con().executemany, sql, seq_of_params)
+
+@contextmanager
+def transaction():
+    """
+    Единица работы: все execute/executemany внутри блока фиксируются одним COMMIT.
+    Работает на соединении текущего потока; вложенные блоки — через SAVEPOINT.
+    """
+    con = get_con()
+    depth = getattr(_local, "tx_depth", 0)
+    con.execute(f"SAVEPOINT sp{depth}" if depth else "BEGIN IMMEDIATE")
+    _local.tx_depth = depth + 1
+    try:
+        yield con
+    except BaseException:
+        if depth:
+            con.execute(f"ROLLBACK TO sp{depth}")
+            con.execute(f"RELEASE sp{depth}")
+        else:
+            con.execute("ROLLBACK")
+        raise
+    else:
+        con.execute(f"RELEASE sp{depth}" if depth else "COMMIT")
+    finally:
+        _local.tx_depth = depth
 
 def fetchone(sql: str, params: tuple = ()):
-    with closing(sqlite3.connect(DB_PATH)) as con:
-        cur = con.execute(sql, params)
-        return cur.fetchone()
+    return _timed(sql, lambda: get_con().execute(sql, params).fetchone())
 
 def fetchall(sql: str, params: tuple = ()):
-    with closing(sqlite3.connect(DB_PATH)) as con:
-        cur = con.execute(sql, params)
-        return cur.fetchall()
+    return _timed(sql, lambda: get_con().execute(sql, params).fetchall())
+
+# ---- async API: не блокирует event loop ----
+def _in_thread(caller, fn, *args):
+    # имя вызывающего хендлера для лога медленных запросов: в потоке БД стек уже чужой
+    _local.caller = caller
+    try:
+        return fn(*args)
+    finally:
+        _local.caller = None
+
+async def awrite(fn, *args):
+    """Выполнить fn(*args) в потоке-писателе."""
+    caller = _caller() if DB_STATS else None
+    return await asyncio.get_running_loop().run_in_executor(_pools()[0], _in_thread, caller, fn, *args)
+
+async def aread(fn, *args):
+    """Выполнить fn(*args) в одном из потоков-читателей."""
+    caller = _caller() if DB_STATS else None
+    return await asyncio.get_running_loop().run_in_executor(_pools()[1], _in_thread, caller, fn, *args)
+
+async def atransaction(fn, *args):
+    """Выполнить fn(*args) в потоке-писателе внутри одной транзакции."""
+    def run():
+        with transaction():
+            return fn(*args)
+    return await awrite(run)
+
+async def aexecute(sql: str, params: tuple = ()):
+    return await awrite(execute, sql, params)
+
+async def afetchone(sql: str, params: tuple = ()):
+    return await aread(fetchone, sql, params)
+
+async def afetchall(sql: str, params: tuple = ()):
+    return await aread(fetchall, sql, params)
+
+async def abackfill_fts(batch: int = 500, pause: float = 0.05):
+    """Фоновое заполнение drafts_fts для строк, созданных до миграции (см. migrations)."""
+    total = 0
+    while True:
+        left = await awrite(lambda: backfill_fts_batch(get_con(), batch))
+        total += 1
+        if not left:
+            break
+        await asyncio.sleep(pause)  # даём место другим записям
+    if total > 1:
+        log.info("FTS backfill finished (%s batches)", total)
+
+# ---- settings (кэш в памяти, write-through) ----
+_settings: dict[str, str] | None = None
+_settings_at = 0.0
+_settings_lock = threading.Lock()
+
+def load_settings() -> dict[str, str]:
+    """Загрузить всю таблицу settings одним запросом."""
+    global _settings, _settings_at
+    rows = fetchall("SELECT key, value FROM settings")
+    with _settings_lock:
+        _settings = {k: v for k, v in rows}
+        _settings_at = time.monotonic()
+        return _settings
+
+def _settings_cache() -> dict[str, str]:
+    cache = _settings
+    if cache is None or (SETTINGS_CACHE_TTL > 0 and time.monotonic() - _settings_at > SETTINGS_CACHE_TTL):
+        cache = load_settings()
+    return cache
 
 def get_setting(key: str):
-    row = fetchone("SELECT value FROM settings WHERE key=?", (key,))
-    return row[0] if row else None
+    return _settings_cache().get(key)
+
+def get_settings(keys) -> dict[str, str | None]:
+    cache = _settings_cache()
+    return {k: cache.get(k) for k in keys}
 
 def set_setting(key: str, value: str):
     execute(
@@ -98,3 +291,12 @@ def set_setting(key: str, value: str):
         "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
         (key, value)
     )
+    with _settings_lock:
+        if _settings is not None:
+            _settings[key] = value
+
+def delete_setting(key: str):
+    execute("DELETE FROM settings WHERE key=?", (key,))
+    with _settings_lock:
+        if _settings is not None:
+            _settings.pop(key, None)
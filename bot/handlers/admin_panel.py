@@ -1,30 +1,16 @@
 
+import html
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from ..config import get_config
-from ..db import execute, fetchall, fetchone, get_setting, set_setting
+from ..db import execute, fetchall, fetchone, get_setting, get_settings, set_setting, delete_setting, query_stats, reset_query_stats
 
 router = Router(name="admin_panel")
 cfg = get_config()
 
-def ensure_schema():
-    execute("""
-    CREATE TABLE IF NOT EXISTS feeds(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        url TEXT UNIQUE NOT NULL,
-        title TEXT,
-        active INTEGER NOT NULL DEFAULT 1,
-        etag TEXT,
-        last_modified TEXT,
-        tags TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-ensure_schema()
-
 def _is_admin(uid: int) -> bool:
     return (not cfg.admin_ids) or (uid in cfg.admin_ids)
 
@@ -167,7 +153,7 @@ async def ai_receive_prompt(message: Message, state: FSMContext):
         await message.answer("Доступ запрещён."); return
     text = (message.text or "").strip()
     if text == "—":
-        execute("DELETE FROM settings WHERE key=?", ("AI_PROMPT",))
+        delete_setting("AI_PROMPT")
         await message.answer("✅ Сброшено.")
     else:
         set_setting("AI_PROMPT", text)
@@ -180,8 +166,10 @@ class SettingsStates(StatesGroup):
 
 def _kb_settings() -> InlineKeyboardMarkup:
     rows = []
-    for key, title in [("TARGET_CHANNEL_ID","ID канала"),("TRAILING_URL","Ссылка‑хвост"),("TRAILING_TEXT","Текст хвоста"),("TZ","Часовой пояс"),("RSS_POLL_INTERVAL","Интервал RSS, сек")]:
-        val = get_setting(key)
+    keys = [("TARGET_CHANNEL_ID","ID канала"),("TRAILING_URL","Ссылка‑хвост"),("TRAILING_TEXT","Текст хвоста"),("TZ","Часовой пояс"),("RSS_POLL_INTERVAL","Интервал RSS, сек")]
+    values = get_settings([k for k, _ in keys])
+    for key, title in keys:
+        val = values[key]
         rows.append([InlineKeyboardButton(text=f"{title}: {val or '—'}", callback_data=f"set:key:{key}")])
     rows.append([InlineKeyboardButton(text="⬅️ В меню", callback_data="admin:menu")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -206,7 +194,7 @@ async def settings_receive_value(message: Message, state: FSMContext):
         await message.answer("Нет доступа."); return
     data = await state.get_data(); key = data.get("key"); val = (message.text or "").strip()
     if val == "—":
-        execute("DELETE FROM settings WHERE key=?", (key,)); await state.clear()
+        delete_setting(key); await state.clear()
         await message.answer("✅ Сброшено."); return
     if key == "TARGET_CHANNEL_ID":
         try: int(val)
@@ -214,6 +202,26 @@ async def settings_receive_value(message: Message, state: FSMContext):
     set_setting(key, val); await state.clear(); await message.answer("✅ Сохранено.")
 
 
+@router.message(Command("dbstats"))
+async def cmd_dbstats(message: Message):
+    """Топ SQL по суммарному времени. «/dbstats reset» — обнулить счётчики."""
+    if not _is_admin(message.from_user.id):
+        await message.answer("Доступ запрещён."); return
+    if (message.text or "").split()[1:2] == ["reset"]:
+        reset_query_stats()
+        await message.answer("✅ Статистика запросов сброшена."); return
+    stats = query_stats(limit=10)
+    if not stats:
+        await message.answer("Статистики пока нет (или DB_STATS выключен)."); return
+    lines = ["🗄 SQL: всего мс · вызовов · ср/макс мс"]
+    for st in stats:
+        lines.append(
+            f"<b>{st['total_ms']:.0f}</b> · {st['count']} · {st['avg_ms']:.2f}/{st['max_ms']:.1f}\n"
+            f"<code>{html.escape(st['sql'][:160])}</code>"
+        )
+    await message.answer("\n".join(lines)[:4096])
+
+
 @router.callback_query(F.data == "admin:help")
 async def cb_admin_help(cb: CallbackQuery):
     await cb.message.answer("Справка: используйте меню для управления лентами, настройками, очередью, черновиками и архивом.")
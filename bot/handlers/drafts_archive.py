@@ -1,7 +1,11 @@
 
+import html
+import re
+from collections import OrderedDict
 from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
 from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
-from ..db import fetchall
+from ..db import fetchall, aread
 from ..config import get_config
 from .forwarded_to_draft import _show_preview
 
@@ -11,7 +15,52 @@ cfg = get_config()
 def _is_admin(uid: int) -> bool:
     return (not cfg.admin_ids) or (uid in cfg.admin_ids)
 
-def _kb_from_rows(rows, prefix: str, page: int, per_page: int, back_cb: str = None) -> InlineKeyboardMarkup:
+# ------ keyset-пагинация ------
+# Курсор — (ts, id) крайней строки страницы; в callback_data кладём цифры ts и id: "dr:next:20250901093000:42"
+
+def _cursor_encode(ts: str | None, did: int) -> str:
+    digits = "".join(ch for ch in (ts or "") if ch.isdigit())[:14]
+    return f"{digits}:{did}"
+
+def _cursor_decode(raw: str) -> tuple[str, int]:
+    digits, did = raw.split(":")
+    ts = f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]} {digits[8:10]}:{digits[10:12]}:{digits[12:14]}"
+    return ts, int(did)
+
+# (WHERE, выражение сортировки, индекс) для каждого списка
+_LISTS = {
+    "dr": ("status IN ('draft','queued')", "created_at", "idx_drafts_open_created"),
+    "ar": ("status IN ('published','deleted')", "COALESCE(published_at, created_at)", "idx_drafts_archive_sort"),
+}
+
+def _fetch_page(prefix: str, cursor: str | None, direction: str, per_page: int):
+    """
+    Страница списка после/до курсора. Возвращает (rows, has_newer, has_older);
+    rows всегда в порядке «новые сверху».
+    """
+    where, key, index = _LISTS[prefix]
+    params: tuple = ()
+    if cursor:
+        ts, did = _cursor_decode(cursor)
+        if direction == "prev":
+            # первое условие — диапазон по индексу, второе — точная граница по (ts, id)
+            where += f" AND {key} >= ? AND ({key}, id) > (?, ?)"
+        else:
+            where += f" AND {key} <= ? AND ({key}, id) < (?, ?)"
+        params = (ts, ts, did)
+    order = "ASC" if direction == "prev" else "DESC"
+    rows = fetchall(
+        f"SELECT id, {key}, text FROM drafts INDEXED BY {index} "
+        f"WHERE {where} ORDER BY {key} {order}, id {order} LIMIT ?",
+        params + (per_page + 1,),
+    )
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == "prev":
+        return rows[::-1], more, True
+    return rows, bool(cursor), more
+
+def _kb_from_rows(rows, prefix: str, has_newer: bool, has_older: bool, back_cb: str = None) -> InlineKeyboardMarkup:
     kb = []
     for did, created_at, text in rows:
         date = (created_at or "")[:16].replace("T"," ")
@@ -19,36 +68,24 @@ def _kb_from_rows(rows, prefix: str, page: int, per_page: int, back_cb: str = No
         if len(snippet) > 40: snippet = snippet[:40] + "…"
         kb.append([InlineKeyboardButton(text=f"{date} · {snippet}", callback_data=f"{prefix}:{did}")])
     nav = []
-    if page > 1:
-        nav.append(InlineKeyboardButton(text="« Назад", callback_data=f"{prefix}:page:{page-1}"))
-    if len(rows) == per_page:
-        nav.append(InlineKeyboardButton(text="Вперёд »", callback_data=f"{prefix}:page:{page+1}"))
+    if rows and has_newer:
+        first = rows[0]
+        nav.append(InlineKeyboardButton(text="« Назад", callback_data=f"{prefix}:prev:{_cursor_encode(first[1], first[0])}"))
+    if rows and has_older:
+        last = rows[-1]
+        nav.append(InlineKeyboardButton(text="Вперёд »", callback_data=f"{prefix}:next:{_cursor_encode(last[1], last[0])}"))
     if nav: kb.append(nav)
     if back_cb:
         kb.append([InlineKeyboardButton(text="⬅️ В меню", callback_data=back_cb)])
     return InlineKeyboardMarkup(inline_keyboard=kb or [[InlineKeyboardButton(text="Нет элементов", callback_data="noop")]])
 
-async def _show_drafts_list(message: Message, page: int = 1, per_page: int = 10):
-    offset = (page-1)*per_page
-    rows = fetchall("""
-        SELECT id, created_at, text
-        FROM drafts
-        WHERE status IN ('draft','queued')
-        ORDER BY created_at DESC
-        LIMIT ? OFFSET ?
-    """, (per_page, offset))
-    await message.answer("Черновики:", reply_markup=_kb_from_rows(rows, "dr", page, per_page, "admin:menu"))
-
-async def _show_archive_list(message: Message, page: int = 1, per_page: int = 10):
-    offset = (page-1)*per_page
-    rows = fetchall("""
-        SELECT id, COALESCE(published_at, created_at), text
-        FROM drafts
-        WHERE status IN ('published','deleted')
-        ORDER BY COALESCE(published_at, created_at) DESC
-        LIMIT ? OFFSET ?
-    """, (per_page, offset))
-    await message.answer("Архив:", reply_markup=_kb_from_rows(rows, "ar", page, per_page, "admin:menu"))
+async def _show_drafts_list(message: Message, cursor: str | None = None, direction: str = "next", per_page: int = 10):
+    rows, has_newer, has_older = await aread(_fetch_page, "dr", cursor, direction, per_page)
+    await message.answer("Черновики:", reply_markup=_kb_from_rows(rows, "dr", has_newer, has_older, "admin:menu"))
+
+async def _show_archive_list(message: Message, cursor: str | None = None, direction: str = "next", per_page: int = 10):
+    rows, has_newer, has_older = await aread(_fetch_page, "ar", cursor, direction, per_page)
+    await message.answer("Архив:", reply_markup=_kb_from_rows(rows, "ar", has_newer, has_older, "admin:menu"))
 
 @router.callback_query(F.data == "menu:drafts")
 async def cb_open_drafts(cb: CallbackQuery):
@@ -57,10 +94,16 @@ async def cb_open_drafts(cb: CallbackQuery):
     await _show_drafts_list(cb.message)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("dr:page:"))
+@router.callback_query(F.data.startswith("dr:next:") | F.data.startswith("dr:prev:"))
 async def cb_drafts_page(cb: CallbackQuery):
-    page = int(cb.data.split(":")[2])
-    await _show_drafts_list(cb.message, page=page)
+    _, direction, cursor = cb.data.split(":", 2)
+    await _show_drafts_list(cb.message, cursor=cursor, direction=direction)
+    await cb.answer()
+
+@router.callback_query(F.data.startswith("dr:page:"))
+async def cb_drafts_page_legacy(cb: CallbackQuery):
+    # кнопки из старых сообщений (пагинация по номеру страницы) — открываем начало списка
+    await _show_drafts_list(cb.message)
     await cb.answer()
 
 @router.callback_query(F.data.startswith("dr:"))
@@ -78,10 +121,15 @@ async def cb_open_archive(cb: CallbackQuery):
     await _show_archive_list(cb.message)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("ar:page:"))
+@router.callback_query(F.data.startswith("ar:next:") | F.data.startswith("ar:prev:"))
 async def cb_archive_page(cb: CallbackQuery):
-    page = int(cb.data.split(":")[2])
-    await _show_archive_list(cb.message, page=page)
+    _, direction, cursor = cb.data.split(":", 2)
+    await _show_archive_list(cb.message, cursor=cursor, direction=direction)
+    await cb.answer()
+
+@router.callback_query(F.data.startswith("ar:page:"))
+async def cb_archive_page_legacy(cb: CallbackQuery):
+    await _show_archive_list(cb.message)
     await cb.answer()
 
 @router.callback_query(F.data.startswith("ar:"))
@@ -91,3 +139,74 @@ async def cb_archive_open(cb: CallbackQuery):
     did = int(cb.data.split(":")[1])
     await _show_preview(cb.message, did)
     await cb.answer()
+
+# ------ полнотекстовый поиск: /find <запрос> ------
+FIND_PER_PAGE = 10
+# callback_data ограничена 64 байтами — сам запрос храним в памяти, в кнопках только его номер
+_find_queries: "OrderedDict[int, str]" = OrderedDict()
+_find_seq = 0
+
+def _fts_query(q: str) -> str:
+    """Слова пользователя -> безопасный MATCH-запрос: каждое слово в кавычках, с префиксным поиском."""
+    words = re.findall(r"\w+", q or "")
+    return " ".join(f'"{w}"*' for w in words[:10])
+
+def _search(q: str, page: int, per_page: int = FIND_PER_PAGE):
+    match = _fts_query(q)
+    if not match:
+        return []
+    return fetchall(
+        "SELECT d.id, COALESCE(d.published_at, d.created_at), d.text "
+        "FROM drafts_fts f JOIN drafts d ON d.id = f.rowid "
+        "WHERE drafts_fts MATCH ? ORDER BY f.rank LIMIT ? OFFSET ?",
+        (match, per_page + 1, (page - 1) * per_page),
+    )
+
+def _remember_query(q: str) -> int:
+    global _find_seq
+    _find_seq += 1
+    _find_queries[_find_seq] = q
+    while len(_find_queries) > 256:
+        _find_queries.popitem(last=False)
+    return _find_seq
+
+async def _show_find_results(message: Message, qid: int, page: int = 1):
+    q = _find_queries.get(qid)
+    if q is None:
+        await message.answer("Поиск устарел — повторите /find."); return
+    rows = await aread(_search, q, page)
+    more = len(rows) > FIND_PER_PAGE
+    rows = rows[:FIND_PER_PAGE]
+    kb = []
+    for did, ts, text in rows:
+        date = (ts or "")[:16]
+        snippet = (text or "").strip().replace("\n", " ")
+        if len(snippet) > 40: snippet = snippet[:40] + "…"
+        # открываем через тот же обработчик dr: -> _show_preview
+        kb.append([InlineKeyboardButton(text=f"{date} · {snippet}", callback_data=f"dr:{did}")])
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton(text="« Назад", callback_data=f"fd:{qid}:{page-1}"))
+    if more:
+        nav.append(InlineKeyboardButton(text="Вперёд »", callback_data=f"fd:{qid}:{page+1}"))
+    if nav: kb.append(nav)
+    if not rows:
+        await message.answer(f"По запросу «{html.escape(q)}» ничего не найдено."); return
+    await message.answer(f"Найдено по «{html.escape(q)}» (стр. {page}):", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+
+@router.message(Command("find"))
+async def cmd_find(message: Message, command: CommandObject):
+    if not _is_admin(message.from_user.id):
+        return
+    q = (command.args or "").strip()
+    if not _fts_query(q):
+        await message.answer("Использование: <code>/find слова для поиска</code>"); return
+    await _show_find_results(message, _remember_query(q))
+
+@router.callback_query(F.data.startswith("fd:"))
+async def cb_find_page(cb: CallbackQuery):
+    if not _is_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True); return
+    _, qid, page = cb.data.split(":")
+    await _show_find_results(cb.message, int(qid), int(page))
+    await cb.answer()
@@ -3,9 +3,10 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from ..db import execute
+from ..db import execute, awrite
 from ..config import get_config
 from .forwarded_to_draft import _show_preview
+from ..scheduler import precompile_payload
 
 router = Router()
 cfg = get_config()
@@ -38,6 +39,7 @@ async def set_buttons(message: Message, state: FSMContext):
     txt = (message.text or "").strip()
     if not txt:
         execute("UPDATE drafts SET buttons_json=NULL WHERE id=?", (did,))
+        await awrite(precompile_payload, did)
         await message.answer("Кнопки очищены. Предпросмотр ниже:")
         await _show_preview(message, did)
         await state.clear(); return
@@ -50,6 +52,7 @@ async def set_buttons(message: Message, state: FSMContext):
             if t and u:
                 items.append({"text": t, "url": u})
     execute("UPDATE drafts SET buttons_json=? WHERE id=?", (json.dumps(items, ensure_ascii=False), did))
+    await awrite(precompile_payload, did)
     await message.answer("Кнопки обновлены. Предпросмотр ниже:")
     await _show_preview(message, did)
     await state.clear()
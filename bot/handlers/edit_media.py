@@ -3,10 +3,11 @@ from aiogram.types import CallbackQuery, Message, ContentType
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
-from ..db import execute, fetchone
+from ..db import execute, fetchone, awrite
 from ..config import get_config
 from ..keyboards import draft_controls
 from ..handlers.forwarded_to_draft import _render_html  # используем тот же форматтер ссылок
+from ..scheduler import precompile_payload
 
 router = Router()
 cfg = get_config()
@@ -50,6 +51,7 @@ async def set_media(message: Message, state: FSMContext):
         "UPDATE drafts SET content_type=?, media_file_id=?, album_json=NULL WHERE id=?",
         (new_type, file_id, did),
     )
+    await awrite(precompile_payload, did)
 
     # Достаём актуальный текст черновика и собираем caption
     row = fetchone("SELECT text FROM drafts WHERE id=?", (did,))
@@ -2,10 +2,11 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from ..db import execute, fetchone
+from ..db import execute, fetchone, awrite
 from ..config import get_config
 from ..keyboards import draft_controls
 from ..handlers.forwarded_to_draft import _render_html
+from ..scheduler import precompile_payload
 
 router = Router()
 cfg = get_config()
@@ -35,6 +36,7 @@ async def set_text(message: Message, state: FSMContext):
 
     # Обновляем в БД
     execute("UPDATE drafts SET text=? WHERE id=?", (new_text, did))
+    await awrite(precompile_payload, did)
 
     # Достаём обновлённый текст
     row = fetchone("SELECT text FROM drafts WHERE id=?", (did,))
@@ -2,7 +2,7 @@ import json
 import os
 from aiogram import Router, F
 from aiogram.types import Message, ContentType
-from ..db import execute, fetchone, get_setting
+from ..db import execute, afetchone, get_settings
 from ..keyboards import draft_controls
 from ..config import get_config
 from ..utils.media_group_buffer import MediaGroupBuffer
@@ -24,9 +24,8 @@ def _escape_html(s: str) -> str:
 
 def _trailing_values() -> tuple[str, str]:
     """Получить хвост ссылки и текст из настроек."""
-    url = (get_setting("TRAILING_URL") or "").strip()
-    text = (get_setting("TRAILING_TEXT") or "").strip()
-    return url, text
+    vals = get_settings(("TRAILING_URL", "TRAILING_TEXT"))
+    return (vals["TRAILING_URL"] or "").strip(), (vals["TRAILING_TEXT"] or "").strip()
 
 def _render_html(body: str) -> str:
     """Экранируем HTML и делаем красивую ссылку без превью."""
@@ -56,7 +55,7 @@ async def _show_preview(message: Message, draft_id: int):
       - альбом: первая медиа + подпись (если влезает), иначе альбомная карточка без подписи + текстом;
       - текст: просто текст.
     """
-    row = fetchone(
+    row = await afetchone(
         "SELECT content_type, text, media_file_id, album_json FROM drafts WHERE id=?",
         (draft_id,)
     )
@@ -1,8 +1,8 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from ..config import get_config
-from ..db import execute
-from ..scheduler import publish_now
+from ..db import execute, atransaction
+from ..scheduler import publish_now, wake_scheduler
 
 router = Router()
 cfg = get_config()
@@ -10,6 +10,11 @@ cfg = get_config()
 def _is_admin(uid: int) -> bool:
     return (not cfg.admin_ids) or (uid in cfg.admin_ids)
 
+def _delete_draft(did: int):
+    execute("UPDATE drafts SET status='deleted' WHERE id=?", (did,))
+    execute("UPDATE schedules SET status='canceled' WHERE draft_id=? AND status IN ('pending','running','dead')", (did,))
+    execute("DELETE FROM publish_payloads WHERE draft_id=?", (did,))
+
 @router.callback_query(F.data.startswith("pub:"))
 async def publish(cb: CallbackQuery):
     """
@@ -37,7 +42,7 @@ async def delete_draft(cb: CallbackQuery):
         await cb.answer("Нет доступа", show_alert=True); return
 
     did = int(cb.data.split(":")[1])
-    execute("UPDATE drafts SET status='deleted' WHERE id=?", (did,))
-    execute("UPDATE schedules SET status='canceled' WHERE draft_id=? AND status IN ('pending','running')", (did,))
+    await atransaction(_delete_draft, did)
+    wake_scheduler()
     await cb.message.answer(f"Черновик №{did} удалён и слоты отменены.")
     await cb.answer()
@@ -1,36 +1,42 @@
+import html
+import logging
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from ..db import fetchall, fetchone, execute
+from ..db import fetchone, execute, afetchall, afetchone, awrite
 from ..config import get_config
 from .forwarded_to_draft import _show_preview
-from ..scheduler import publish_now
+from .. import scheduler
+from ..scheduler import publish_now, wake_scheduler, claim_slot, get_channel_id, hold_lease
 
 router = Router()
 cfg = get_config()
+log = logging.getLogger(__name__)
 
 def _is_admin(uid: int) -> bool:
     return (not cfg.admin_ids) or (uid in cfg.admin_ids)
 
 # --------- helpers ----------
-def _render_queue_kb():
-    rows = fetchall(
-        "SELECT s.id, s.draft_id, strftime('%d.%m %H:%M', s.run_at), d.content_type "
+async def _render_queue_kb():
+    # сначала «мёртвые» (попытки исчерпаны) — их нужно разобрать руками, затем очередь по времени
+    rows = await afetchall(
+        "SELECT s.id, s.draft_id, strftime('%d.%m %H:%M', s.run_at), d.content_type, s.status, s.attempts "
         "FROM schedules s JOIN drafts d ON d.id = s.draft_id "
-        "WHERE s.status='pending' "
-        "ORDER BY s.run_at ASC, s.id ASC LIMIT 50"
+        "WHERE s.status IN ('pending','dead') "
+        "ORDER BY s.status='dead' DESC, s.run_at ASC, s.id ASC LIMIT 50"
     )
     kb = InlineKeyboardBuilder()
     if not rows:
         kb.row(InlineKeyboardButton(text="(очередь пуста)", callback_data="qnoop"))
     else:
-        for sid, did, run_at, ctype in rows:
-            kb.row(InlineKeyboardButton(text=f"#{sid} • {run_at} • d{did} • {ctype}", callback_data=f"qs:{sid}"))
+        for sid, did, run_at, ctype, status, attempts in rows:
+            mark = "☠️ " if status == "dead" else (f"↻{attempts} " if attempts else "")
+            kb.row(InlineKeyboardButton(text=f"{mark}#{sid} • {run_at} • d{did} • {ctype}", callback_data=f"qs:{sid}"))
     return kb
 
 async def _show_queue_list(msg: Message):
-    kb = _render_queue_kb()
+    kb = await _render_queue_kb()
     text = "Запланированные публикации:"
     try:
         await msg.edit_text(text, reply_markup=kb.as_markup())
@@ -64,17 +70,25 @@ async def open_slot(cb: CallbackQuery):
     if not _is_admin(cb.from_user.id):
         await cb.answer("Нет доступа", show_alert=True); return
     sid = int(cb.data.split(":")[1])
-    row = fetchone(
-        "SELECT s.id, s.draft_id, strftime('%d.%m.%Y %H:%M', s.run_at) "
-        "FROM schedules s WHERE s.id=? AND s.status='pending'", (sid,)
+    row = await afetchone(
+        "SELECT s.id, s.draft_id, strftime('%d.%m.%Y %H:%M', s.run_at), s.status, s.attempts, s.last_error "
+        "FROM schedules s WHERE s.id=? AND s.status IN ('pending','dead')", (sid,)
     )
     if not row:
         await cb.message.answer("Слот не найден или уже неактивен.")
         await _show_queue_list(cb.message)
         await cb.answer(); return
 
-    _, did, when = row
-    await cb.message.answer(f"Слот #{sid} — запланирован на {when} (Мск).")
+    _, did, when, status, attempts, last_error = row
+    if status == "dead":
+        info = f"Слот #{sid} — не опубликован, попытки исчерпаны ({attempts})."
+    else:
+        info = f"Слот #{sid} — запланирован на {when} (Мск)."
+        if attempts:
+            info += f" Повтор №{attempts + 1}."
+    if last_error:
+        info += f"\nОшибка: <code>{html.escape(last_error)}</code>"
+    await cb.message.answer(info)
     await _show_preview(cb.message, did)
 
     kb = InlineKeyboardBuilder()
@@ -82,6 +96,8 @@ async def open_slot(cb: CallbackQuery):
         InlineKeyboardButton(text="✅ Опубликовать сейчас", callback_data=f"qpub:{sid}"),
         InlineKeyboardButton(text="❌ Отменить слот", callback_data=f"qdel:{sid}")
     )
+    if status == "dead":
+        kb.row(InlineKeyboardButton(text="🔁 Вернуть в очередь", callback_data=f"qretry:{sid}"))
     kb.row(InlineKeyboardButton(text="🔙 К списку", callback_data="qback"))
     await cb.message.answer("Действия со слотом:", reply_markup=kb.as_markup())
     await cb.answer()
@@ -92,20 +108,57 @@ async def qdel(cb: CallbackQuery):
         await cb.answer("Нет доступа", show_alert=True); return
     sid = int(cb.data.split(":")[1])
     execute("UPDATE schedules SET status='canceled' WHERE id=? AND status!='done'", (sid,))
+    wake_scheduler()
     await cb.message.answer(f"Слот #{sid} отменён.")
     await cb.answer()
 
+@router.callback_query(F.data.startswith("qretry:"))
+async def qretry(cb: CallbackQuery):
+    if not _is_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True); return
+    sid = int(cb.data.split(":")[1])
+    execute(
+        "UPDATE schedules SET status='pending', attempts=0, last_error=NULL, "
+        "run_at=strftime('%Y-%m-%d %H:%M:%S','now','localtime') WHERE id=? AND status='dead'",
+        (sid,),
+    )
+    wake_scheduler()
+    await cb.message.answer(f"Слот #{sid} возвращён в очередь.")
+    await cb.answer()
+
 @router.callback_query(F.data.startswith("qpub:"))
 async def qpub(cb: CallbackQuery):
     if not _is_admin(cb.from_user.id):
         await cb.answer("Нет доступа", show_alert=True); return
     sid = int(cb.data.split(":")[1])
-    row = fetchone("SELECT draft_id FROM schedules WHERE id=? AND status='pending'", (sid,))
+    row = fetchone("SELECT draft_id, status FROM schedules WHERE id=? AND status IN ('pending','dead')", (sid,))
     if not row:
         await cb.message.answer("Слот не найден или уже неактивен.")
         await cb.answer(); return
-    did = int(row[0])
-    ok = await publish_now(cb.message.bot, did)
-    execute("UPDATE schedules SET status=? WHERE id=?", ("done" if ok else "canceled", sid))
+    did, prev_status = int(row[0]), row[1]
+    channel_id = get_channel_id()
+    # тот же захват, что у публикатора: слот не уйдёт в канал дважды
+    if channel_id is None or not await awrite(claim_slot, sid, channel_id, ("pending", "dead")):
+        await cb.message.answer("Слот уже публикуется — попробуйте позже.")
+        await cb.answer(); return
+    try:
+        async with hold_lease(sid):
+            ok = await publish_now(cb.message.bot, did, schedule_id=sid)
+    except Exception as e:
+        # слот возвращается в прежнее состояние: «мёртвый» не должен тихо уйти в автоповтор
+        log.exception("Manual publish of slot %s failed", sid)
+        execute(
+            "UPDATE schedules SET status=?, last_error=?, lease_owner=NULL, lease_until=NULL "
+            "WHERE id=? AND status='running' AND lease_owner=?",
+            (prev_status, f"{type(e).__name__}: {e}"[:500], sid, scheduler.INSTANCE_ID),
+        )
+        await cb.message.answer(f"Не удалось опубликовать: {html.escape(str(e)[:200])}")
+        await cb.answer(); return
+    if not ok:
+        execute(
+            "UPDATE schedules SET status='canceled', lease_owner=NULL, lease_until=NULL "
+            "WHERE id=? AND status='running' AND lease_owner=?",
+            (sid, scheduler.INSTANCE_ID),
+        )
     await cb.message.answer("✅ Опубликовано." if ok else "Не удалось опубликовать.")
     await cb.answer()
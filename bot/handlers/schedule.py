@@ -2,10 +2,11 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from ..db import execute
+from ..db import execute, atransaction
 from ..config import get_config
 from ..utils.parse_dt import parse_user_dt
 from .queue import _show_queue_list
+from ..scheduler import wake_scheduler, precompile_payload
 
 router = Router()
 cfg = get_config()
@@ -16,6 +17,12 @@ def _is_admin(uid: int) -> bool:
 class SchedStates(StatesGroup):
     waiting = State()
 
+def _create_slot(did: int, run_at: str):
+    execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, ?)", (did, run_at))
+    execute("UPDATE drafts SET status='queued' WHERE id=?", (did,))
+    # пост собирается сейчас, публикатору останется только отправить
+    precompile_payload(did)
+
 @router.callback_query(F.data.startswith("sched:"))
 async def ask_time(cb: CallbackQuery, state: FSMContext):
     if not _is_admin(cb.from_user.id):
@@ -41,8 +48,8 @@ async def set_time(message: Message, state: FSMContext):
 
     data = await state.get_data()
     did = int(data.get("draft_id"))
-    execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, ?)", (did, dt.strftime("%Y-%m-%d %H:%M:%S")))
-    execute("UPDATE drafts SET status='queued' WHERE id=?", (did,))
+    await atransaction(_create_slot, did, dt.strftime("%Y-%m-%d %H:%M:%S"))
+    wake_scheduler()
 
     # Только подтверждение, без повторного поста
     await message.answer(f"Запланировано на {dt.strftime('%d.%m.%Y %H:%M')} (Мск). Команда: /queue — список.")
@@ -6,9 +6,10 @@ from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
 from .config import get_config
-from .db import init_db
+from .db import init_db, close_all, abackfill_fts
 from .scheduler import setup_scheduler
-from .rss_worker import setup_rss_worker
+from .rss_worker import setup_rss_worker, aclose_http_client, close_parse_pool
+from . import ai_format
 from .handlers import (
     start,
     drafts_archive,
@@ -39,6 +40,8 @@ async def main():
 
     # Создаём БД/таблицы при первом запуске
     init_db()
+    # Дозаполнение поискового индекса по старым черновикам — в фоне
+    fts_task = asyncio.create_task(abackfill_fts())
 
     # aiogram 3.7+: parse_mode через DefaultBotProperties
     bot = Bot(
@@ -65,14 +68,22 @@ async def main():
     dp.include_router(admin_panel.router)
     dp.include_router(_admin_menu_back.router)
 
-    # Планировщик публикаций по расписанию
-    setup_scheduler(bot)
+    # Публикатор по расписанию: спит до ближайшего слота
+    publisher = setup_scheduler(bot)
 
     # Стартуем RSS‑воркер (локальный ИИ на CPU)
     setup_rss_worker(bot)
 
     logging.info("Bot is running (long polling mode)...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        fts_task.cancel()
+        publisher.cancel()
+        await aclose_http_client()
+        close_parse_pool()
+        await ai_format.aclose()
+        close_all()
 
 
 if __name__ == "__main__":
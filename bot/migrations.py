@@ -0,0 +1,276 @@
+"""
+Версионированные миграции схемы.
+
+Текущая версия хранится в PRAGMA user_version. Каждый шаг — функция step(con),
+выполняется в своей транзакции вместе с повышением user_version и обязан быть
+идемпотентным (старые базы могли получить часть изменений ad-hoc ALTER'ами).
+Если схема актуальна, migrate() сводится к одному чтению user_version.
+"""
+import logging
+import os
+import sqlite3
+
+log = logging.getLogger(__name__)
+
+MODELS_PATH = os.path.join(os.path.dirname(__file__), "models.sql")
+
+
+# ------------ helpers ------------
+def _table_exists(con, name: str) -> bool:
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+def _col_names(con, table: str) -> list[str]:
+    return [r[1] for r in con.execute(f"PRAGMA table_info({table})").fetchall()]
+
+def _add_column(con, table: str, column: str, decl: str):
+    if _table_exists(con, table) and column not in _col_names(con, table):
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _run_script(con, script: str):
+    """Аналог executescript, но без неявного COMMIT — шаг остаётся в своей транзакции."""
+    buf = ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            con.execute(buf)
+            buf = ""
+    if buf.strip() and not buf.strip().startswith("--"):
+        con.execute(buf)
+
+
+# ------------ steps ------------
+def _m001_baseline(con):
+    # базы, созданные до появления колонок: индексы из models.sql ссылаются на hash
+    _add_column(con, "feeds", "etag", "TEXT")
+    _add_column(con, "feeds", "last_modified", "TEXT")
+    _add_column(con, "feed_entries", "hash", "TEXT")
+    _add_column(con, "drafts", "hash", "TEXT")
+    _add_column(con, "drafts", "media_url", "TEXT")
+    _add_column(con, "drafts", "source_url", "TEXT")
+    _add_column(con, "draft_meta", "hash", "TEXT")
+    _add_column(con, "draft_meta", "media_url", "TEXT")
+
+    with open(MODELS_PATH, "r", encoding="utf-8") as f:
+        _run_script(con, f.read())
+
+    # новая база: models.sql создаёт feeds без валидаторов HTTP-кэша
+    _add_column(con, "feeds", "etag", "TEXT")
+    _add_column(con, "feeds", "last_modified", "TEXT")
+
+
+def _m002_list_indexes(con):
+    # keyset-пагинация списков черновиков и архива: порядок выдачи = порядок индекса
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_drafts_open_created "
+        "ON drafts(created_at DESC, id DESC) WHERE status IN ('draft','queued')"
+    )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_drafts_archive_sort "
+        "ON drafts(COALESCE(published_at, created_at) DESC, id DESC) WHERE status IN ('published','deleted')"
+    )
+
+
+def _m003_drafts_fts(con):
+    # полнотекстовый индекс по черновикам/архиву; rowid = drafts.id
+    con.execute("CREATE VIRTUAL TABLE IF NOT EXISTS drafts_fts USING fts5(text, source_url, tokenize='unicode61 remove_diacritics 2')")
+    con.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_drafts_fts_ai AFTER INSERT ON drafts BEGIN "
+        "INSERT INTO drafts_fts(rowid, text, source_url) VALUES (new.id, new.text, new.source_url); END"
+    )
+    con.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_drafts_fts_au AFTER UPDATE OF text, source_url ON drafts BEGIN "
+        "DELETE FROM drafts_fts WHERE rowid = old.id; "
+        "INSERT INTO drafts_fts(rowid, text, source_url) VALUES (new.id, new.text, new.source_url); END"
+    )
+    con.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_drafts_fts_ad AFTER DELETE ON drafts BEGIN "
+        "DELETE FROM drafts_fts WHERE rowid = old.id; END"
+    )
+    # существующие строки индексируются в фоне пачками (backfill_fts_batch), чтобы не держать старт
+    con.execute("CREATE TABLE IF NOT EXISTS bg_jobs (name TEXT PRIMARY KEY, pos INTEGER NOT NULL)")
+    con.execute(
+        "INSERT OR IGNORE INTO bg_jobs(name, pos) SELECT 'drafts_fts', COALESCE(MAX(id), 0) FROM drafts"
+    )
+
+
+def _m004_feed_fingerprint(con):
+    # отпечаток тела ленты — для серверов без ETag/Last-Modified
+    _add_column(con, "feeds", "content_hash", "TEXT")
+
+
+def _m005_entry_queue(con):
+    # feed_entries — промежуточное хранилище: стадия загрузки пишет 'new', обогащение доводит до 'done'
+    _add_column(con, "feed_entries", "state", "TEXT NOT NULL DEFAULT 'new'")   # new|done
+    _add_column(con, "feed_entries", "attempts", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(con, "feed_entries", "last_error", "TEXT")
+    _add_column(con, "feed_entries", "draft_id", "INTEGER")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_feed_entries_new ON feed_entries(id) WHERE state='new'")
+
+
+def _m006_feed_polling(con):
+    # адаптивный опрос: у каждой ленты свой интервал и момент следующей загрузки (unix-время)
+    _add_column(con, "feeds", "next_poll_at", "INTEGER")
+    _add_column(con, "feeds", "poll_interval", "INTEGER")
+    _add_column(con, "feeds", "error_count", "INTEGER NOT NULL DEFAULT 0")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_feeds_next_poll ON feeds(next_poll_at) WHERE active=1")
+
+
+def _m007_ai_cache(con):
+    # результаты ИИ-оформления: key = sha256(prompt, model, текст)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS ai_cache ("
+        " key TEXT PRIMARY KEY, model TEXT, output TEXT NOT NULL,"
+        " created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+
+
+def _m008_entry_simhash(con):
+    # почти-дубли: SimHash записи + 6 полос (utils/simhash.bands), каждая со своим индексом
+    # (при расстоянии <= 5 у похожих записей совпадает хотя бы одна полоса)
+    _add_column(con, "feed_entries", "simhash", "INTEGER")
+    _add_column(con, "feed_entries", "dup_of", "INTEGER")
+    for i in range(6):
+        _add_column(con, "feed_entries", f"sh_b{i}", "INTEGER")
+        con.execute(f"CREATE INDEX IF NOT EXISTS idx_feed_entries_sh_b{i} ON feed_entries(sh_b{i}) WHERE sh_b{i} IS NOT NULL")
+
+
+def _m009_schedules_due(con):
+    # публикатор: ближайший pending-слот (MIN(run_at)) и выборка наступивших — по индексу
+    con.execute("CREATE INDEX IF NOT EXISTS idx_schedules_status_run ON schedules(status, run_at)")
+
+
+def _m010_schedule_retries(con):
+    # повтор неудачных публикаций: счётчик попыток, последняя ошибка; status='dead' — попытки исчерпаны
+    _add_column(con, "schedules", "attempts", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(con, "schedules", "last_error", "TEXT")
+
+
+def _m011_schedule_leases(con):
+    # захват слота экземпляром бота: кто держит и до какого момента (unix-время);
+    # просроченный 'running' подбирает любой экземпляр
+    _add_column(con, "schedules", "lease_owner", "TEXT")
+    _add_column(con, "schedules", "lease_until", "INTEGER")
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_schedules_lease ON schedules(lease_until) "
+        "WHERE status='running'"
+    )
+
+
+def _m012_publish_payloads(con):
+    # готовый к отправке пост (HTML, подписи, клавиатура, медиа) — собирается при постановке в очередь;
+    # fingerprint — настройки хвоста-ссылки, с которыми собран; правка черновика удаляет запись
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS publish_payloads ("
+        " draft_id INTEGER PRIMARY KEY, fingerprint TEXT NOT NULL, payload TEXT NOT NULL,"
+        " created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+    con.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_drafts_payload_au AFTER UPDATE OF "
+        "content_type, text, parse_mode, disable_web_page_preview, silent, "
+        "media_file_id, media_url, album_json, buttons_json, channel_id ON drafts BEGIN "
+        "DELETE FROM publish_payloads WHERE draft_id = old.id; END"
+    )
+    con.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_drafts_payload_ad AFTER DELETE ON drafts BEGIN "
+        "DELETE FROM publish_payloads WHERE draft_id = old.id; END"
+    )
+
+
+def _m013_schedule_progress(con):
+    # пост из нескольких сообщений (медиа + длинный текст, альбом + текст): сколько шагов уже
+    # отправлено — повтор после ошибки продолжает со следующего, не дублируя отправленное
+    _add_column(con, "schedules", "sent_steps", "INTEGER NOT NULL DEFAULT 0")
+
+
+
+def _m014_simhash_window(con):
+    # полосы SimHash ищутся только в окне fetched_at: (sh_bN, fetched_at) — окно ограничивает
+    # диапазон по индексу, старые записи с той же полосой не перебираются
+    for i in range(6):
+        con.execute(f"DROP INDEX IF EXISTS idx_feed_entries_sh_b{i}")
+        con.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_feed_entries_sh_b{i}_at ON feed_entries(sh_b{i}, fetched_at) "
+            f"WHERE sh_b{i} IS NOT NULL"
+        )
+
+
+
+def _m015_ai_cache_age(con):
+    # ai_cache чистится по возрасту (ai_format.prune_cache) — удаление по индексу
+    con.execute("CREATE INDEX IF NOT EXISTS idx_ai_cache_created ON ai_cache(created_at)")
+
+
+# (версия, название, шаг) — только дописывать в конец, номера не переиспользовать
+MIGRATIONS = [
+    (1, "baseline", _m001_baseline),
+    (2, "list_indexes", _m002_list_indexes),
+    (3, "drafts_fts", _m003_drafts_fts),
+    (4, "feed_fingerprint", _m004_feed_fingerprint),
+    (5, "entry_queue", _m005_entry_queue),
+    (6, "feed_polling", _m006_feed_polling),
+    (7, "ai_cache", _m007_ai_cache),
+    (8, "entry_simhash", _m008_entry_simhash),
+    (9, "schedules_due", _m009_schedules_due),
+    (10, "schedule_retries", _m010_schedule_retries),
+    (11, "schedule_leases", _m011_schedule_leases),
+    (12, "publish_payloads", _m012_publish_payloads),
+    (13, "schedule_progress", _m013_schedule_progress),
+    (14, "simhash_window", _m014_simhash_window),
+    (15, "ai_cache_age", _m015_ai_cache_age),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def schema_version(con) -> int:
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(con) -> int:
+    """Применить недостающие шаги. con должен быть в autocommit (isolation_level=None)."""
+    if schema_version(con) >= LATEST:
+        return LATEST
+    for version, name, step in MIGRATIONS:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            # перепроверяем под блокировкой: параллельный процесс мог уже применить шаг
+            if schema_version(con) >= version:
+                con.execute("ROLLBACK")
+                continue
+            step(con)
+            con.execute(f"PRAGMA user_version={version}")
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        log.info("DB migration %s (%s) applied", version, name)
+    return LATEST
+
+
+# ------------ фоновые дозаполнения ------------
+def backfill_fts_batch(con, batch: int = 500) -> int:
+    """
+    Проиндексировать очередную пачку старых черновиков (сверху вниз по id).
+    Возвращает оставшуюся верхнюю границу; 0 — индекс полный.
+    """
+    row = con.execute("SELECT pos FROM bg_jobs WHERE name='drafts_fts'").fetchone() if _table_exists(con, "bg_jobs") else None
+    if not row:
+        return 0
+    upto = int(row[0])
+    lo = max(0, upto - batch)
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        # строки, изменённые после миграции, уже попали в индекс триггером
+        con.execute(
+            "INSERT INTO drafts_fts(rowid, text, source_url) "
+            "SELECT id, text, source_url FROM drafts WHERE id > ? AND id <= ? "
+            "AND id NOT IN (SELECT rowid FROM drafts_fts WHERE rowid > ? AND rowid <= ?)",
+            (lo, upto, lo, upto),
+        )
+        if lo:
+            con.execute("UPDATE bg_jobs SET pos=? WHERE name='drafts_fts'", (lo,))
+        else:
+            con.execute("DELETE FROM bg_jobs WHERE name='drafts_fts'")
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return lo
@@ -1,3 +1,5 @@
+-- Базовая схема (миграция 1 в migrations.py). Дальнейшие изменения — только новыми шагами миграций.
+
 -- Настройки
 CREATE TABLE IF NOT EXISTS settings (
   key   TEXT PRIMARY KEY,
@@ -1,10 +1,16 @@
 
 import asyncio
 import logging
+import multiprocessing
 import os
 import re
 import hashlib
 import html
+import importlib.util
+import random
+import statistics
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta, timezone
 
@@ -13,28 +19,74 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import httpx
 from aiogram import Bot
 from email.utils import parsedate_to_datetime
-
-from .db import fetchall, fetchone, execute, init_db, get_setting
-
-try:
-    from openai import AsyncOpenAI
-except Exception:  # pragma: no cover - fallback if lib missing
-    AsyncOpenAI = None
+from urllib.parse import urljoin, urlsplit
+
+from .utils.feed_parser import FeedParser, ParseError as FeedParseError
+from .utils.feed_items import (
+    ITEM_FIELDS, parse_body,
+    text_clean as _text_clean, clean_item as _clean_item,
+    extract_items_regex as _extract_items_regex,
+)
+from .utils.seen_index import SeenIndex
+from .utils.ttl_cache import TTLCache
+from .utils import simhash as sh
+from .utils.tg_limiter import limiter
+from . import ai_format
+from .db import fetchall, execute, executemany, transaction, get_con, get_setting, afetchall, aread, awrite
 
 log = logging.getLogger(__name__)
 
 __all__ = [
     "process_feeds_once",
+    "ingest_feeds_once",
+    "enrich_entries_once",
     "setup_scheduler",
     "setup_rss_worker",
+    "get_http_client",
+    "aclose_http_client",
+    "close_parse_pool",
 ]
 
 # ------------------------
 # Настройки
 # ------------------------
-DEFAULT_INTERVAL_SEC = int(os.getenv("RSS_POLL_INTERVAL", "180"))
+DEFAULT_INTERVAL_SEC = int(os.getenv("RSS_POLL_INTERVAL", "180"))   # стартовый интервал опроса новой ленты
+RSS_POLL_MIN = max(30, int(os.getenv("RSS_POLL_MIN", "60")))         # «горячие» ленты — не чаще
+RSS_POLL_MAX = max(RSS_POLL_MIN, int(os.getenv("RSS_POLL_MAX", "21600")))  # редкие/сломанные — не реже
+RSS_TICK_SEC = int(os.getenv("RSS_TICK_SEC", "30"))                  # как часто проверять, какие ленты пора опросить
 MAX_ITEMS_PER_CYCLE = int(os.getenv("RSS_MAX_PER_CYCLE", "10"))  # <= 10 по требованию
-NOTIFY_PER_CYCLE = int(os.getenv("RSS_NOTIFY_PER_CYCLE", "3"))
+NOTIFY_PER_CYCLE = int(os.getenv("RSS_NOTIFY_PER_CYCLE", "3"))  # строк на ленту в сводке, остальное — «и ещё N»
+NOTIFY_DIGEST_MAX = max(1, int(os.getenv("RSS_NOTIFY_DIGEST_MAX", "200")))  # неотправленная сводка хранит последние N
+RSS_ENRICH_BATCH = max(1, int(os.getenv("RSS_ENRICH_BATCH", "50")))        # записей на проход обогащения
+RSS_ENRICH_MAX_ATTEMPTS = max(1, int(os.getenv("RSS_ENRICH_MAX_ATTEMPTS", "3")))
+FINGERPRINT_BYTES = 64 * 1024  # отпечаток ленты — по началу тела
+RSS_CONCURRENCY = max(1, int(os.getenv("RSS_CONCURRENCY", "10")))  # лент одновременно
+RSS_PER_HOST = max(1, int(os.getenv("RSS_PER_HOST", "2")))         # одновременных загрузок с одного хоста
+
+# Где разбирать тело ленты: inline (по умолчанию) — потоково в event loop, чтение прекращается
+# после MAX_ITEMS_PER_CYCLE элементов. thread/process — по выбору для развёртываний, где упираемся
+# в CPU: тело скачивается целиком (до RSS_MAX_FEED_BYTES), разбирается и чистится в пуле,
+# loop получает готовые кортежи. process задействует несколько ядер.
+RSS_PARSE_EXECUTOR = os.getenv("RSS_PARSE_EXECUTOR", "inline").lower()
+RSS_PARSE_WORKERS = max(1, int(os.getenv("RSS_PARSE_WORKERS", str(min(4, os.cpu_count() or 1)))))
+RSS_MAX_FEED_BYTES = int(os.getenv("RSS_MAX_FEED_BYTES", str(4 * 1024 * 1024)))
+
+# Почти-дубли (одна история в разных лентах): допустимое расстояние Хэмминга SimHash (<0 — выключено)
+# и окно сравнения по времени загрузки
+RSS_SIMHASH_DISTANCE = min(int(os.getenv("RSS_SIMHASH_DISTANCE", "5")), sh.MAX_DISTANCE)
+RSS_SIMHASH_WINDOW_H = max(1, int(os.getenv("RSS_SIMHASH_WINDOW_H", "72")))
+
+# Общий HTTP-клиент воркера: пул соединений живёт между циклами (keep-alive, TLS-сессии)
+RSS_HTTP_MAX_CONN = max(1, int(os.getenv("RSS_HTTP_MAX_CONN", "20")))
+RSS_HTTP_KEEPALIVE = max(0, int(os.getenv("RSS_HTTP_KEEPALIVE", "10")))
+RSS_HTTP_KEEPALIVE_SEC = float(os.getenv("RSS_HTTP_KEEPALIVE_SEC", "300"))
+RSS_HTTP2 = os.getenv("RSS_HTTP2", "1").lower() not in {"0", "false", "no", "off"}
+
+# og:image: читаем страницу только до </head> (или до лимита), результат кэшируем по URL
+OG_MAX_BYTES = int(os.getenv("RSS_OG_MAX_BYTES", str(256 * 1024)))
+OG_CONCURRENCY = max(1, int(os.getenv("RSS_OG_CONCURRENCY", "8")))
+OG_CACHE_TTL = int(os.getenv("RSS_OG_CACHE_TTL", "86400"))
+OG_DOMAIN_MISSES = int(os.getenv("RSS_OG_DOMAIN_MISSES", "5"))  # подряд страниц без og:image — домен пропускаем на OG_CACHE_TTL
 
 RSS_INCLUDE_LINK = os.getenv("RSS_INCLUDE_LINK", "1").lower() not in {
     "0", "false", "no", "off"
@@ -61,24 +113,15 @@ def _parse_date(s: Optional[str]) -> Optional[datetime]:
         return None
     try:
         dt = parsedate_to_datetime(s)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone()
     except Exception:
-        return None
-
-def _text_clean(s: str) -> str:
-    if not s:
-        return ""
-    # Уберем html-теги
-    s = re.sub(r"<[^>]+>", "", s)
-    # Раскодируем HTML-сущности
-    s = html.unescape(s)
-    # Удалим &nbsp; и другие невидимые символы
-    s = re.sub(r"[\u00A0\u200B-\u200D\uFEFF]", " ", s)
-    # Сжимаем лишние пробелы
-    s = re.sub(r"\s+", " ", s, flags=re.M).strip()
-    return s
+        # Atom: ISO 8601 (2025-09-01T10:00:00Z)
+        try:
+            dt = datetime.fromisoformat(s.strip().replace("Z", "+00:00"))
+        except Exception:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone()
 
 def _hash_item(parts: List[str]) -> str:
     h = hashlib.sha256()
@@ -87,84 +130,262 @@ def _hash_item(parts: List[str]) -> str:
         h.update(b"\x1f")
     return h.hexdigest()
 
-async def _http_get(client: httpx.AsyncClient, url: str) -> Optional[str]:
+_SY_PERIOD_SEC = {"hourly": 3600, "daily": 86400, "weekly": 7 * 86400, "monthly": 30 * 86400, "yearly": 365 * 86400}
+
+def _header_min_sec(headers) -> Optional[int]:
+    """Сколько сервер просит не перезапрашивать: Retry-After / Cache-Control max-age / Expires, сек."""
+    ra = headers.get("Retry-After")
+    if ra and ra.strip().isdigit():
+        return int(ra.strip())
+    m = re.search(r"max-age\s*=\s*(\d+)", headers.get("Cache-Control") or "", re.I)
+    if m:
+        return int(m.group(1))
+    exp = headers.get("Expires")
+    if exp:
+        try:
+            return max(0, int((parsedate_to_datetime(exp) - datetime.now(timezone.utc)).total_seconds()))
+        except Exception:
+            pass
+    return None
+
+def _meta_min_sec(meta: Dict[str, str]) -> Optional[int]:
+    """Подсказки самой ленты: <ttl> (минуты), <sy:updatePeriod>/<sy:updateFrequency>."""
+    out = None
+    ttl = meta.get("ttl") or ""
+    if ttl.isdigit():
+        out = int(ttl) * 60
+    period = _SY_PERIOD_SEC.get((meta.get("updatePeriod") or "").lower())
+    if period:
+        freq = meta.get("updateFrequency") or "1"
+        sy = period // max(1, int(freq)) if freq.isdigit() else period
+        out = max(out or 0, sy)
+    return out
+
+async def _fetch_feed(client: httpx.AsyncClient, url: str, etag: Optional[str],
+                      last_modified: Optional[str], content_hash: Optional[str]):
+    """
+    Условный GET ленты с потоковым разбором. Возвращает (items, validators, hints):
+      items=None — лента не изменилась (304 или тот же отпечаток начала тела) либо ошибка;
+      validators — (etag, last_modified, content_hash) для сохранения, None — сохранять нечего;
+      hints — {"error": bool, "min_sec": int|None} для расчёта следующего опроса.
+    Тело читается кусками и сразу скармливается парсеру; после MAX_ITEMS_PER_CYCLE элементов
+    чтение прекращается. Отпечаток считается по первым FINGERPRINT_BYTES — новые записи
+    появляются в начале ленты, а хвост мы всё равно не читаем.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    hints: Dict[str, Any] = {"error": False, "min_sec": None}
     try:
-        r = await client.get(url, timeout=15)
-        r.raise_for_status()
-        return r.text
+        async with client.stream("GET", url, headers=headers, timeout=15) as r:
+            hints["min_sec"] = _header_min_sec(r.headers)
+            if r.status_code == 304:
+                return None, None, hints
+            r.raise_for_status()
+
+            chunks = r.aiter_bytes()
+            raw: List[bytes] = []
+            head_len = 0
+            async for chunk in chunks:
+                raw.append(chunk)
+                head_len += len(chunk)
+                if head_len >= FINGERPRINT_BYTES:
+                    break
+            head = b"".join(raw)
+            fp = hashlib.sha256(head[:FINGERPRINT_BYTES]).hexdigest()
+            validators = (r.headers.get("ETag"), r.headers.get("Last-Modified"), fp)
+            if fp == content_hash:
+                # сервер без валидаторов, но начало ленты то же — не разбираем
+                return None, validators, hints
+
+            if RSS_PARSE_EXECUTOR in ("thread", "process"):
+                size = len(head)
+                async for chunk in chunks:
+                    if size >= RSS_MAX_FEED_BYTES:
+                        break
+                    raw.append(chunk)
+                    size += len(chunk)
+                rows, meta = await asyncio.get_running_loop().run_in_executor(
+                    _parse_pool(), parse_body, b"".join(raw)[:RSS_MAX_FEED_BYTES], r.encoding, MAX_ITEMS_PER_CYCLE,
+                )
+                meta_sec = _meta_min_sec(meta)
+                if meta_sec:
+                    hints["min_sec"] = max(hints["min_sec"] or 0, meta_sec)
+                return [dict(zip(ITEM_FIELDS, row)) for row in rows], validators, hints
+
+            parser = FeedParser(limit=MAX_ITEMS_PER_CYCLE)
+            found: List[Dict[str, Any]] = []
+            try:
+                found += parser.feed(head)
+                async for chunk in chunks:
+                    if parser.done:
+                        break
+                    raw.append(chunk)
+                    found += parser.feed(chunk)
+                if not parser.done:
+                    found += parser.close()
+                items = [_clean_item(it) for it in found]
+                meta_sec = _meta_min_sec(parser.meta)
+                if meta_sec:
+                    hints["min_sec"] = max(hints["min_sec"] or 0, meta_sec)
+            except FeedParseError:
+                # невалидный XML (неизвестные сущности, незаявленные префиксы) — дочитываем и разбираем regex'ом
+                size = sum(len(c) for c in raw)
+                async for chunk in chunks:
+                    if size >= RSS_MAX_FEED_BYTES:
+                        break
+                    raw.append(chunk)
+                    size += len(chunk)
+                body = b"".join(raw)[:RSS_MAX_FEED_BYTES]
+                text = body.decode(r.encoding or "utf-8", errors="replace")
+                items = _extract_items_regex(text)[:MAX_ITEMS_PER_CYCLE]
+            return items, validators, hints
     except Exception as e:
         log.warning("HTTP GET failed %s: %s", url, e)
-        return None
-
-def _xml_findall(text: str, tag: str) -> List[str]:
-    # очень простой извлекатель <tag>...</tag> из RSS (чтобы не тянуть лишние зависимости)
-    # не идеален, но для большинства лент работает
-    pat = re.compile(rf"<{tag}[^>]*>(.*?)</{tag}>", re.I | re.S)
-    return pat.findall(text or "")
-
-def _xml_first(text: str, tag: str) -> Optional[str]:
-    arr = _xml_findall(text, tag)
-    return arr[0] if arr else None
-
-def _extract_items(rss_xml: str) -> List[Dict[str, Any]]:
-    # Ищем block <item>...</item>
-    items_raw = re.findall(r"<item\b.*?</item>", rss_xml or "", re.I | re.S)
-    items: List[Dict[str, Any]] = []
-    for raw in items_raw:
-        title = _xml_first(raw, "title") or ""
-        link = _xml_first(raw, "link") or ""
-        guid = _xml_first(raw, "guid") or ""
-        pubdate = _xml_first(raw, "pubDate") or _xml_first(raw, "published") or _xml_first(raw, "updated")
-        description = _xml_first(raw, "description") or ""
-        media_url = None
-        for tag in ("enclosure", "media:content"):
-            m = re.search(rf"<{tag}[^>]+?(?:url|href)=['\"]([^'\"]+)['\"]", raw, re.I)
-            if m:
-                media_url = m.group(1).strip()
-                break
-        items.append({
-            "title": _text_clean(title),
-            "link": link.strip(),
-            "guid": guid.strip(),
-            "pubdate": pubdate.strip() if pubdate else None,
-            "summary": _text_clean(description),
-            "media_url": media_url,
-            "raw": raw,
-        })
-    return items
-
-def _already_seen(hash_hex: str) -> bool:
-    row = fetchone("SELECT 1 FROM drafts WHERE hash = ? LIMIT 1", (hash_hex,))
-    return bool(row)
-
-def _insert_draft(text: str, media_url: Optional[str], source_url: str, hash_hex: str) -> int:
-    content_type = "photo" if media_url else "text"
-    cur = execute(
-        "INSERT INTO drafts (author_id, content_type, text, media_url, source_url, hash, status, created_at) "
-        "VALUES (0, ?, ?, ?, ?, ?, 'draft', datetime('now'))",
-        (content_type, text, media_url, source_url, hash_hex),
+        hints["error"] = True
+        return None, None, hints
+
+_parse_executor: Optional[Executor] = None
+
+def _parse_pool() -> Executor:
+    global _parse_executor
+    if _parse_executor is None:
+        if RSS_PARSE_EXECUTOR == "process":
+            # spawn: родитель многопоточный (потоки БД), fork здесь небезопасен
+            _parse_executor = ProcessPoolExecutor(
+                max_workers=RSS_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            _parse_executor = ThreadPoolExecutor(max_workers=RSS_PARSE_WORKERS, thread_name_prefix="rss-parse")
+    return _parse_executor
+
+def close_parse_pool():
+    """Остановить пул разбора лент (при остановке процесса)."""
+    global _parse_executor
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=False, cancel_futures=True)
+    _parse_executor = None
+
+def _next_interval(prev: Optional[int], dates: List[datetime], new_count: int,
+                   min_sec: Optional[int], errors: int) -> int:
+    """
+    Интервал до следующего опроса ленты, сек:
+      - ошибки — экспоненциальная пауза от стартового интервала;
+      - есть даты записей — половина медианного промежутка между публикациями;
+      - иначе от прошлого интервала: появилось новое — чаще, ничего — реже;
+    подсказки сервера/ленты (min_sec) — нижняя граница; итог в [RSS_POLL_MIN, RSS_POLL_MAX].
+    """
+    base = prev or DEFAULT_INTERVAL_SEC
+    if errors:
+        sec = DEFAULT_INTERVAL_SEC * 2 ** min(errors, 10)
+    elif len(dates) >= 2:
+        ordered = sorted(dates, reverse=True)
+        gaps = [(a - b).total_seconds() for a, b in zip(ordered, ordered[1:])]
+        sec = statistics.median(gaps) / 2
+    elif new_count:
+        sec = base / 2
+    else:
+        sec = base * 1.5
+    sec = max(sec, min_sec or 0)
+    return int(max(RSS_POLL_MIN, min(sec, RSS_POLL_MAX)))
+
+def _save_validators(fid: int, validators: tuple):
+    etag, last_modified, fp = validators
+    execute(
+        "UPDATE feeds SET etag=?, last_modified=?, content_hash=? WHERE id=?",
+        (etag, last_modified, fp, fid),
     )
-    return int(cur.lastrowid) if cur else 0
 
-async def _notify_admins(bot: Bot, draft_id: int, title: str):
+# Дедуп: индекс хешей в памяти (прогревается из drafts.hash) + одно подтверждение на ленту
+_seen = SeenIndex()
+
+def _warm_seen():
+    _seen.warm(h for (h,) in get_con().execute("SELECT hash FROM drafts WHERE hash IS NOT NULL"))
+    log.info("RSS seen-index warmed: %d hashes", len(_seen))
+
+def _confirm_seen(hashes: List[str]) -> set:
+    """Какие из «возможно виденных» хешей действительно есть в drafts — один запрос."""
+    if not hashes:
+        return set()
+    marks = ",".join("?" * len(hashes))
+    return {h for (h,) in fetchall(f"SELECT hash FROM drafts WHERE hash IN ({marks})", tuple(hashes))}
+
+def _insert_drafts(batch: List[tuple]) -> Dict[str, int]:
+    """Пакетная вставка (text, media_url, source_url, hash) одной транзакцией; возвращает {hash: draft_id}."""
+    if not batch:
+        return {}
+    rows = [("photo" if media_url else "text", text, media_url, source_url, hash_hex)
+            for text, media_url, source_url, hash_hex in batch]
+    with transaction():
+        executemany(
+            "INSERT OR IGNORE INTO drafts (author_id, content_type, text, media_url, source_url, hash, status, created_at) "
+            "VALUES (0, ?, ?, ?, ?, ?, 'draft', datetime('now'))",
+            rows,
+        )
+        hashes = [r[4] for r in rows]
+        marks = ",".join("?" * len(hashes))
+        found = fetchall(f"SELECT hash, id FROM drafts WHERE hash IN ({marks})", tuple(hashes))
+    return {h: int(i) for h, i in found}
+
+def _admin_ids() -> List[int]:
     # Пытаемся взять список админов из таблицы настроек, иначе из ENV ADMIN_IDS через запятую
     admin_ids: List[int] = []
     try:
-        rows = fetchall("SELECT value FROM settings WHERE key='admin_ids' LIMIT 1")
-        if rows and rows[0] and rows[0][0]:
-            admin_ids = [int(x) for x in rows[0][0].replace(" ", "").split(",") if x]
+        raw = get_setting("admin_ids")
+        if raw:
+            admin_ids = [int(x) for x in raw.replace(" ", "").split(",") if x]
     except Exception:
         pass
     if not admin_ids:
         env_ids = os.getenv("ADMIN_IDS", "")
         if env_ids:
             admin_ids = [int(x) for x in env_ids.replace(" ", "").split(",") if x]
-
-    for uid in admin_ids[:3]:
+    return admin_ids
+
+# новые черновики цикла (feed_id, draft_id, title) — уходят одной сводкой на админа
+_digest: List[tuple] = []
+
+def _digest_text(notes: List[tuple]) -> str:
+    lines = [f"🤖 Новые черновики: {len(notes)}"]
+    shown: Dict[int, int] = {}
+    hidden = 0
+    for fid, draft_id, title in notes:
+        if shown.get(fid, 0) >= NOTIFY_PER_CYCLE:
+            hidden += 1
+            continue
+        shown[fid] = shown.get(fid, 0) + 1
+        lines.append(f"#{draft_id}: {html.escape(title[:120])}")
+    if hidden:
+        lines.append(f"…и ещё {hidden} (/drafts)")
+    return "\n".join(lines)[:4000]
+
+async def _flush_digest(bot: Bot):
+    """Отправить накопленную сводку каждому админу через общий ограничитель Telegram."""
+    if not _digest or bot is None:
+        return
+    admins = _admin_ids()
+    if not admins:
+        _digest.clear()
+        return
+    notes = list(_digest)
+    text = _digest_text(notes)
+    sent = False
+    for uid in admins:
         try:
-            await bot.send_message(uid, f"🤖 Новый черновик #{draft_id}: {title[:120]}")
+            await limiter.send(uid, bot.send_message, uid, text)
+            sent = True
         except Exception as e:
             log.warning("notify_admin %s failed: %s", uid, e)
+    if sent:
+        del _digest[:len(notes)]
+    elif len(_digest) > NOTIFY_DIGEST_MAX:
+        # админы недоступны: сводка не должна расти от тика к тику, старые строки отбрасываем
+        dropped = _digest[:-NOTIFY_DIGEST_MAX]
+        del _digest[:-NOTIFY_DIGEST_MAX]
+        log.warning("Admin digest undelivered, dropped %d oldest note(s): drafts %s",
+                    len(dropped), ", ".join(f"#{d}" for _, d, _ in dropped))
 
 def _build_post_text(title: str, summary: str, url: str) -> str:
     title = _text_clean(title)
@@ -179,105 +400,381 @@ def _build_post_text(title: str, summary: str, url: str) -> str:
     return "\n\n".join([b for b in blocks if b])
 
 
-async def _format_with_ai(text: str) -> str:
-    """Formats text via OpenAI using prompt from settings."""
-    prompt = (get_setting("AI_PROMPT") or "").strip()
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not prompt or not api_key or AsyncOpenAI is None:
-        return text
+async def _format_with_ai(text: str, strict: bool = False) -> str:
+    """Formats text via OpenAI using prompt from settings (см. ai_format: кэш, лимит, breaker).
+
+    strict=True — ошибку API пробрасываем (запись останется в очереди до следующей попытки).
+    """
+    return await ai_format.format_text(text, strict=strict)
+
+_OG_RE = re.compile(
+    r"""<meta\b(?=[^>]*\b(?:property|name)\s*=\s*["']og:image(?::url)?["'])[^>]*\bcontent\s*=\s*["']([^"']+)["']""",
+    re.I,
+)
+_og_cache = TTLCache(maxsize=4096, ttl=OG_CACHE_TTL)      # url -> og:image | None
+_og_domains = TTLCache(maxsize=1024, ttl=OG_CACHE_TTL)    # host -> сколько страниц подряд без og:image
+
+async def _fetch_og_image(client: httpx.AsyncClient, url: str) -> Optional[str]:
+    """Потоковое чтение страницы до </head> или OG_MAX_BYTES; тело статьи не качаем."""
     try:
-        client = AsyncOpenAI(api_key=api_key)
-        model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        resp = await client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": text},
-            ],
-        )
-        return resp.choices[0].message.content.strip()
+        async with client.stream("GET", url, timeout=15, headers={"Accept": "text/html"}) as r:
+            r.raise_for_status()
+            ctype = r.headers.get("Content-Type", "")
+            if ctype and "html" not in ctype.lower():
+                return None
+            buf = b""
+            async for chunk in r.aiter_bytes():
+                # </head> ищем в новом куске с нахлёстом на хвост предыдущего
+                tail = max(0, len(buf) - 6)
+                buf += chunk
+                if b"</head" in buf[tail:].lower() or len(buf) >= OG_MAX_BYTES:
+                    break
+            text = buf[:OG_MAX_BYTES].decode(r.encoding or "utf-8", errors="replace")
+            m = _OG_RE.search(text)
+            return urljoin(str(r.url), html.unescape(m.group(1).strip())) if m else None
     except Exception as e:
-        log.warning("AI format failed: %s", e)
-        return text
+        log.warning("og:image fetch failed %s: %s", url, e)
+        raise
 
 async def _try_extract_og_image(client: httpx.AsyncClient, url: str) -> Optional[str]:
-    html = await _http_get(client, url)
-    if not html:
-        return None
-    m = re.search(r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', html, re.I)
-    if m:
-        return m.group(1)
-    return None
+    found, cached = _og_cache.lookup(url)
+    if found:
+        return cached
+    host = (urlsplit(url).hostname or "").lower()
+    if _og_domains.get(host, 0) >= OG_DOMAIN_MISSES:
+        return None  # сайт og:image не отдаёт — не ходим
+    try:
+        image = await _fetch_og_image(client, url)
+    except Exception:
+        return None  # сетевые ошибки не кэшируем — в следующий раз попробуем снова
+    _og_cache.set(url, image)
+    _og_domains.set(host, 0 if image else _og_domains.get(host, 0) + 1)
+    return image
+
+async def _og_images(client: httpx.AsyncClient, urls: List[str]) -> Dict[str, Optional[str]]:
+    """og:image для пачки страниц параллельно (не больше OG_CONCURRENCY одновременно)."""
+    sem = asyncio.Semaphore(OG_CONCURRENCY)
+
+    async def one(u: str):
+        async with sem:
+            return u, await _try_extract_og_image(client, u)
+
+    return dict(await asyncio.gather(*(one(u) for u in dict.fromkeys(urls))))
 
 # ------------------------
-# Основной цикл
+# HTTP-клиент
 # ------------------------
-async def process_feeds_once(bot: Bot):
-    # только активные фиды
-    feeds = fetchall("SELECT id, url FROM feeds WHERE COALESCE(active,1)=1 ORDER BY id DESC")
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_http_stats = {"requests": 0, "connects": 0, "tls": 0}
+
+async def _trace(event: str, info: dict):
+    # события httpcore: новое TCP-соединение / TLS-рукопожатие (переиспользование их не порождает)
+    if event == "connection.connect_tcp.complete":
+        _http_stats["connects"] += 1
+    elif event == "connection.start_tls.complete":
+        _http_stats["tls"] += 1
+
+async def _on_request(request: httpx.Request):
+    _http_stats["requests"] += 1
+    request.extensions["trace"] = _trace
+
+def _http2_available() -> bool:
+    # httpx умеет HTTP/2 только с пакетом h2 (pip install httpx[http2])
+    return importlib.util.find_spec("h2") is not None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Долгоживущий клиент воркера (создаётся лениво, один на event loop)."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        http2 = RSS_HTTP2 and _http2_available()
+        _client = httpx.AsyncClient(
+            follow_redirects=True,
+            http2=http2,
+            timeout=httpx.Timeout(15, connect=10),
+            limits=httpx.Limits(
+                max_connections=RSS_HTTP_MAX_CONN,
+                max_keepalive_connections=RSS_HTTP_KEEPALIVE,
+                keepalive_expiry=RSS_HTTP_KEEPALIVE_SEC,
+            ),
+            headers={"User-Agent": "bot/rss-worker", "Accept-Encoding": "gzip, deflate"},
+            event_hooks={"request": [_on_request]},
+        )
+        _client_loop = loop
+        log.info("RSS HTTP client: pool %s (keep-alive %s), http2=%s", RSS_HTTP_MAX_CONN, RSS_HTTP_KEEPALIVE, http2)
+    return _client
+
+async def aclose_http_client():
+    """Закрыть общий клиент (при остановке процесса)."""
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client = _client_loop = None
+
+def _log_http_stats():
+    req, conn, tls = _http_stats["requests"], _http_stats["connects"], _http_stats["tls"]
+    if req:
+        log.info(
+            "RSS HTTP: %d requests, %d new connections (%d TLS handshakes), reused %.0f%%",
+            req, conn, tls, 100.0 * max(0, req - conn) / req,
+        )
+    for k in _http_stats:
+        _http_stats[k] = 0
+
+
+# ------------------------
+# Стадия 1: загрузка лент -> feed_entries
+# ------------------------
+def _stage_entries(fid: int, entries: List[Dict[str, Any]], validators: Optional[tuple], schedule: tuple):
+    """
+    Сырые записи ленты + валидаторы HTTP-кэша + следующий опрос (next_poll_at, poll_interval, error_count)
+    одной транзакцией; дубли по (feed_id, hash) игнорируются.
+    """
+    with transaction():
+        # уже поставленные в очередь записи (повторный опрос) не сравниваем и не логируем заново
+        staged = set()
+        if entries:
+            marks = ",".join("?" * len(entries))
+            staged = {h for (h,) in fetchall(
+                f"SELECT hash FROM feed_entries WHERE feed_id=? AND hash IN ({marks})",
+                (fid, *(it["hash"] for it in entries)),
+            )}
+        # по одной: почти-дубль может найтись и среди только что вставленных записей этой же пачки
+        for it in entries:
+            if it["hash"] in staged:
+                continue
+            staged.add(it["hash"])
+            h = it.get("simhash")
+            dup_of = _near_duplicate(fid, it["hash"], h) if h is not None else None
+            b = sh.bands(h) if h is not None else [None] * sh.BANDS
+            execute(
+                "INSERT INTO feed_entries(feed_id, guid, url, hash, title, published_at, content_html, content_text, image_url, "
+                "simhash, sh_b0, sh_b1, sh_b2, sh_b3, sh_b4, sh_b5, dup_of, state) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?) ON CONFLICT(feed_id, hash) DO NOTHING",
+                (fid, it["guid"], it["link"], it["hash"], it["title"], it["published_at"],
+                 it.get("html"), it["summary"], it.get("media_url"),
+                 sh.to_signed(h) if h is not None else None, *b, dup_of, "dup" if dup_of else "new"),
+            )
+            if dup_of:
+                log.info("RSS: entry %s from feed %s is a near-duplicate of entry %s", it["link"], fid, dup_of)
+        if validators:
+            _save_validators(fid, validators)
+        execute(
+            "UPDATE feeds SET next_poll_at=?, poll_interval=?, error_count=? WHERE id=?",
+            (*schedule, fid),
+        )
+
+def _near_duplicate(fid: int, hash_hex: str, h: int) -> Optional[int]:
+    """Запись из окна RSS_SIMHASH_WINDOW_H, отличающаяся не больше чем на RSS_SIMHASH_DISTANCE бит."""
+    if RSS_SIMHASH_DISTANCE < 0:
+        return None
+    # кандидаты — по совпадению любой полосы (OR по шести индексам (sh_bN, fetched_at)),
+    # окно — в каждой ветке OR, чтобы оно ограничивало диапазон индекса; расстояние — в Python
+    since = f"-{RSS_SIMHASH_WINDOW_H} hours"
+    rows = fetchall(
+        "SELECT id, feed_id, hash, simhash FROM feed_entries WHERE "
+        + " OR ".join(f"(sh_b{i}=? AND fetched_at >= datetime('now', ?))" for i in range(6))
+        + " ORDER BY id",
+        tuple(x for band in sh.bands(h) for x in (band, since)),
+    )
+    for eid, efid, ehash, esim in rows:
+        if efid == fid and ehash == hash_hex:
+            continue  # та же запись той же ленты
+        if sh.hamming(sh.from_signed(esim), h) <= RSS_SIMHASH_DISTANCE:
+            return eid
+    return None
+
+def _schedule(interval: int, errors: int) -> tuple:
+    # ±10% разброса, чтобы ленты с одинаковым интервалом не опрашивались одной пачкой
+    return int(time.time() + interval * random.uniform(0.9, 1.1)), interval, errors
+
+async def _ingest_feed(client: httpx.AsyncClient, feed: tuple, cutoff: datetime,
+                       host_sem: asyncio.Semaphore) -> float:
+    """Одна лента: загрузка -> разбор -> дедуп -> feed_entries. Возвращает длительность, сек."""
+    t0 = time.monotonic()
+    fid, url, etag, last_modified, content_hash, poll_interval, error_count = feed
+    # лимит на хост держим только на время загрузки ленты
+    # (разбор идёт потоково, глубина уже ограничена MAX_ITEMS_PER_CYCLE)
+    async with host_sem:
+        items, validators, hints = await _fetch_feed(client, url, etag, last_modified, content_hash)
+    if items is None:
+        errors = (error_count or 0) + 1 if hints["error"] else 0
+        interval = _next_interval(poll_interval, [], 0, hints["min_sec"], errors)
+        if validators == (etag, last_modified, content_hash):
+            validators = None
+        await awrite(_stage_entries, fid, [], validators, _schedule(interval, errors))
+        return time.monotonic() - t0
+
+    # Фильтруем по дате >= cutoff и по уникальности
+    fresh: List[Dict[str, Any]] = []
+    dates: List[datetime] = []
+    for it in items:
+        pub = _parse_date(it.get("pubdate"))
+        if pub:
+            dates.append(pub)
+        if pub and pub < cutoff:
+            continue  # старое
+        title = it.get("title") or ""
+        link = it.get("link") or ""
+        guid = it.get("guid") or ""
+        fresh.append({**it, "hash": _hash_item([str(fid), guid, link, title]),
+                      "published_at": pub.isoformat() if pub else None})
+    # промах в индексе — точно новое; попадания подтверждаем одним запросом на ленту
+    maybe = [it["hash"] for it in fresh if it["hash"] in _seen]
+    seen = await aread(_confirm_seen, maybe) if maybe else set()
+    prepared = [it for it in fresh if it["hash"] not in seen]
+    for it in prepared:
+        it["simhash"] = sh.simhash(f'{_text_clean(it.get("title") or "")} {it.get("summary") or ""}')
+
+    # частота публикаций — по датам всех записей ленты, не только свежих
+    interval = _next_interval(poll_interval, dates, len(prepared), hints["min_sec"], 0)
+    # запись в очередь, валидаторы и следующий опрос — атомарно: после COMMIT лента больше не нужна,
+    # даже если обогащение упадёт или ИИ недоступен
+    await awrite(_stage_entries, fid, prepared, validators, _schedule(interval, 0))
+    return time.monotonic() - t0
+
+
+async def ingest_feeds_once(client: httpx.AsyncClient | None = None) -> int:
+    """Стадия 1 для активных лент, которым подошёл срок опроса. Возвращает число обработанных лент."""
+    # только активные фиды, у которых наступил next_poll_at (новые — сразу)
+    feeds = await afetchall(
+        "SELECT id, url, etag, last_modified, content_hash, poll_interval, error_count FROM feeds "
+        "WHERE active=1 AND COALESCE(next_poll_at, 0) <= ? ORDER BY next_poll_at",
+        (int(time.time()),),
+    )
     if not feeds:
-        log.info("RSS: нет активных каналов")
-        return
+        log.debug("RSS: нет лент к опросу")
+        return 0
 
     cutoff = datetime.fromisoformat(RSS_CUTOFF_ISO)
-    log.info("RSS cutoff: %s", cutoff.isoformat())
+    log.debug("RSS cutoff: %s", cutoff.isoformat())
+
+    if not _seen.warmed:
+        await aread(_warm_seen)
+
+    client = client or get_http_client()
+
+    # ленты обрабатываются параллельно: общий лимит + лимит на хост;
+    # каждая лента разбирается сразу по приходу ответа, не дожидаясь остальных
+    global_sem = asyncio.Semaphore(RSS_CONCURRENCY)
+    host_sems: Dict[str, asyncio.Semaphore] = {}
+    durations: Dict[int, float] = {}
+    t0 = time.monotonic()
+
+    async def run(feed: tuple):
+        fid, url = feed[0], feed[1]
+        host = (urlsplit(url).hostname or "").lower()
+        host_sem = host_sems.setdefault(host, asyncio.Semaphore(RSS_PER_HOST))
+        async with global_sem:
+            try:
+                durations[fid] = await _ingest_feed(client, feed, cutoff, host_sem)
+            except Exception as e:
+                log.exception("RSS feed %s failed: %s", fid, e)
+
+    await asyncio.gather(*(run(feed) for feed in feeds))
+
+    wall = time.monotonic() - t0
+    if durations:
+        slow_fid = max(durations, key=durations.get)
+        log.info(
+            "RSS cycle: %d feeds in %.2fs (slowest feed %s: %.2fs, sum of feeds %.2fs)",
+            len(feeds), wall, slow_fid, durations[slow_fid], sum(durations.values()),
+        )
+    return len(feeds)
 
-    async with httpx.AsyncClient(follow_redirects=True, headers={"User-Agent":"bot/rss-worker"}) as client:
-        for fid, url in feeds:
-            rss = await _http_get(client, url)
-            if not rss:
-                continue
-            items = _extract_items(rss)
-
-            # Отсечение глубины: берём не более MAX_ITEMS_PER_CYCLE из верхушки ленты
-            items = items[:MAX_ITEMS_PER_CYCLE]
-
-            # Фильтруем по дате >= cutoff и по уникальности
-            prepared: List[Dict[str, Any]] = []
-            for it in items:
-                pub = _parse_date(it.get("pubdate"))
-                if pub and pub < cutoff:
-                    continue  # старое
-                title = it.get("title") or ""
-                link = it.get("link") or ""
-                guid = it.get("guid") or ""
-                hash_hex = _hash_item([str(fid), guid, link, title])
-                if _already_seen(hash_hex):
-                    continue
-                prepared.append({**it, "hash": hash_hex})
-
-            if not prepared:
-                continue
 
-            # Ограничим кол-во «шумных» уведомлений
-            notif_left = NOTIFY_PER_CYCLE
+# ------------------------
+# Стадия 2: feed_entries -> обложка, ИИ, черновик
+# ------------------------
+def _pending_entries(limit: int):
+    return fetchall(
+        "SELECT id, feed_id, url, guid, hash, title, content_text, image_url, attempts, simhash "
+        "FROM feed_entries WHERE state='new' ORDER BY id LIMIT ?",
+        (limit,),
+    )
 
-            for it in prepared:
-                # малые уступки loop'у
-                await asyncio.sleep(0)
+def _store_enriched(done: List[Dict[str, Any]], failed: List[tuple]) -> Dict[str, int]:
+    """Черновики, draft_meta и статусы записей очереди — одной транзакцией."""
+    with transaction():
+        ids = _insert_drafts([(d["text"], d["media_url"], d["link"], d["hash"]) for d in done])
+        executemany(
+            "INSERT OR IGNORE INTO draft_meta(draft_id, origin, feed_id, entry_id, source_url, simhash) "
+            "VALUES (?, 'rss_ai', ?, ?, ?, ?)",
+            [(ids[d["hash"]], d["feed_id"], d["entry_id"], d["link"], d["simhash"]) for d in done],
+        )
+        executemany(
+            "UPDATE feed_entries SET state='done', draft_id=?, attempts=attempts+1, last_error=NULL WHERE id=?",
+            [(ids[d["hash"]], d["entry_id"]) for d in done],
+        )
+        # неудачная попытка: запись остаётся 'new' — последняя попытка публикует исходный текст
+        executemany(
+            "UPDATE feed_entries SET attempts=attempts+1, last_error=? WHERE id=?",
+            [(err, eid) for eid, err in failed],
+        )
+    return ids
+
+async def enrich_entries_once(bot: Bot, client: httpx.AsyncClient | None = None) -> int:
+    """Стадия 2: берёт записи 'new' из feed_entries и доводит до черновиков. Возвращает число черновиков."""
+    await ai_format.maybe_prune_cache()
+    if not ai_format.available():
+        # breaker открыт: записи ждут в 'new', попытки не тратятся
+        return 0
+    rows = await aread(_pending_entries, RSS_ENRICH_BATCH)
+    if not rows:
+        return 0
+    client = client or get_http_client()
+
+    # обложки для записей без вложения — одной параллельной пачкой (без падений)
+    og = await _og_images(client, [r[2] or r[3] for r in rows if not r[7] and (r[2] or r[3])])
+
+    # ИИ-оформление всей пачки параллельно (лимит одновременных запросов — в ai_format);
+    # на последней попытке при ошибке ИИ публикуем исходный текст
+    last_try = [r[8] + 1 >= RSS_ENRICH_MAX_ATTEMPTS for r in rows]
+    links = [r[2] or r[3] or "" for r in rows]
+    posts = [_build_post_text(r[5] or "", r[6] or "", link) for r, link in zip(rows, links)]
+    texts = await asyncio.gather(*(_format_with_ai(p, strict=True) for p in posts), return_exceptions=True)
+
+    done: List[Dict[str, Any]] = []
+    failed: List[tuple] = []
+    postponed = 0
+    for r, link, last, post, text in zip(rows, links, last_try, posts, texts):
+        eid, fid, _url, _guid, hash_hex, title, _summary, image_url, _attempts, simhash = r
+        if isinstance(text, ai_format.AIUnavailable):
+            # запрос не отправлялся (breaker) — это не попытка, запись остаётся 'new'
+            postponed += 1
+            continue
+        if isinstance(text, BaseException):
+            if not last:
+                failed.append((eid, str(text)[:500]))
+                continue
+            text = post
+        done.append({"entry_id": eid, "feed_id": fid, "hash": hash_hex, "title": title or "", "simhash": simhash,
+                     "text": text, "media_url": image_url or og.get(link), "link": link})
 
-                title = it["title"]
-                link = it["link"] or it["guid"] or ""
-                summary = it.get("summary") or ""
+    ids = await awrite(_store_enriched, done, failed)
+    for h in ids:
+        _seen.add(h)
 
-                # попытка вытащить обложку (без падений)
-                media_url = it.get("media_url")
-                if not media_url:
-                    try:
-                        media_url = await _try_extract_og_image(client, link) if link else None
-                    except Exception:
-                        media_url = None
+    for d in done:
+        draft_id = ids.get(d["hash"])
+        log.info("RSS draft #%s created from feed %s (entry %s)", draft_id, d["feed_id"], d["entry_id"])
+        _digest.append((d["feed_id"], draft_id, d["title"]))
+    # одна сводка на админа за цикл вместо сообщения на каждый черновик
+    await _flush_digest(bot)
+    if failed or postponed:
+        log.warning("RSS enrich: %d entries failed, %d postponed (AI unavailable)", len(failed), postponed)
+    return len(done)
 
-                text = _build_post_text(title, summary, link)
-                text = await _format_with_ai(text)
-                draft_id = _insert_draft(text=text, media_url=media_url, source_url=link, hash_hex=it["hash"])
-                log.info("RSS draft #%s created from feed %s", draft_id, fid)
 
-                if notif_left > 0:
-                    try:
-                        await _notify_admins(bot, draft_id, title)
-                    finally:
-                        notif_left -= 1
+async def process_feeds_once(bot: Bot):
+    """Полный цикл: стадия загрузки, затем обогащение очереди (включая хвосты прошлых циклов)."""
+    client = get_http_client()
+    try:
+        await ingest_feeds_once(client)
+        await enrich_entries_once(bot, client)
+    finally:
+        _log_http_stats()
 
 
 # ------------------------
@@ -286,6 +783,9 @@ async def process_feeds_once(bot: Bot):
 def setup_scheduler(scheduler, bot: Bot, interval_sec: Optional[int] = None):
     """Регистрирует периодическую задачу. Вызывать из main после старта dp/bot.
 
+    interval_sec — период проверки «каким лентам пора»; сами ленты опрашиваются
+    каждая со своим интервалом (feeds.next_poll_at).
+
     Пример:
         scheduler = AsyncIOScheduler(timezone=TZ_NAME)
         setup_scheduler(scheduler, bot, interval_sec=120)
@@ -293,9 +793,9 @@ def setup_scheduler(scheduler, bot: Bot, interval_sec: Optional[int] = None):
     """
     from apscheduler.triggers.interval import IntervalTrigger
 
-    sec = interval_sec or DEFAULT_INTERVAL_SEC
-    sec = max(30, min(sec, 3600))  # безопасность
-    log.info("Setup RSS scheduler: every %ss", sec)
+    sec = interval_sec or RSS_TICK_SEC
+    sec = max(5, min(sec, 3600))  # безопасность
+    log.info("Setup RSS scheduler: tick every %ss, feeds every %s..%ss", sec, RSS_POLL_MIN, RSS_POLL_MAX)
 
     async def tick():
         try:
@@ -307,9 +807,11 @@ def setup_scheduler(scheduler, bot: Bot, interval_sec: Optional[int] = None):
 
 
 def setup_rss_worker(bot: Bot, interval_sec: int | None = None) -> AsyncIOScheduler:
-    """Создаёт и запускает планировщик, выполняющий ``process_feeds_once``."""
+    """Создаёт и запускает планировщик, выполняющий ``process_feeds_once``.
+
+    Схема БД к этому моменту уже поднята ``init_db()`` в main.
+    """
 
-    init_db()
     scheduler = AsyncIOScheduler(timezone=TZ_NAME)
     setup_scheduler(scheduler, bot, interval_sec)
     scheduler.start()
@@ -1,19 +1,45 @@
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.types import (
     InputMediaPhoto, InputMediaVideo, InputMediaDocument,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
 import logging
 import os
-from .db import fetchall, fetchone, execute, get_setting
+import socket
+import time
+from uuid import uuid4
+from .db import execute, fetchone, fetchall, transaction, awrite, afetchall, afetchone, aexecute, atransaction, get_setting, get_settings
 from .config import get_config
+from .utils.tg_limiter import limiter
 
 cfg = get_config()
 log = logging.getLogger(__name__)
 RSS_INCLUDE_LINK = os.getenv("RSS_INCLUDE_LINK", "1").lower() not in {
     "0", "false", "no", "off"
 }
+# страховочная сверка: даже без событий перечитываем очередь не реже раза в N секунд
+SCHEDULER_SWEEP_SEC = max(5.0, float(os.getenv("SCHEDULER_SWEEP_SEC", "300")))
+# сколько каналов публикуется параллельно (внутри канала — строго по порядку run_at)
+PUBLISH_CONCURRENCY = max(1, int(os.getenv("PUBLISH_CONCURRENCY", "4")))
+# неудачная публикация: повтор через PUBLISH_RETRY_BASE * 2^(n-1) сек (не меньше retry_after Telegram),
+# после PUBLISH_MAX_ATTEMPTS попыток слот уходит в 'dead' и виден в /queue
+PUBLISH_MAX_ATTEMPTS = max(1, int(os.getenv("PUBLISH_MAX_ATTEMPTS", "5")))
+PUBLISH_RETRY_BASE = max(1.0, float(os.getenv("PUBLISH_RETRY_BASE", "30")))
+PUBLISH_RETRY_MAX = max(PUBLISH_RETRY_BASE, float(os.getenv("PUBLISH_RETRY_MAX", "3600")))
+# несколько экземпляров бота на одной базе: слот публикует тот, кто захватил его (lease);
+# незавершённый захват (упал/перезапустился) через PUBLISH_LEASE_SEC подберёт любой экземпляр.
+# заданный явно INSTANCE_ID должен быть постоянным между перезапусками и уникальным среди
+# живых экземпляров — тогда свои слоты возвращаются сразу. По умолчанию ID уникален для процесса:
+# соседний воркер на том же хосте не сбросит наши захваты, а свои после рестарта истекут по lease
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+# (пока публикация идёт, захват продлевается каждые PUBLISH_LEASE_SEC/3 — см. hold_lease)
+PUBLISH_LEASE_SEC = max(30, int(os.getenv("PUBLISH_LEASE_SEC", "300")))
+# канал занят другим экземпляром — заглядываем снова не чаще, чем раз в N секунд
+_BUSY_RECHECK_SEC = 1.0
 
 
 def get_channel_id() -> int | None:
@@ -22,42 +48,230 @@ def get_channel_id() -> int | None:
         return int(val)
     return cfg.target_channel_id
 
-def setup_scheduler(bot: Bot) -> AsyncIOScheduler:
-    """Берём все due-слоты в локальном времени и публикуем по очереди."""
-    sched = AsyncIOScheduler(timezone=cfg.timezone)
+_wake: asyncio.Event | None = None
 
-    async def tick():
-        channel_id = get_channel_id()
-        if channel_id is None:
-            log.error("No channel_id configured; skipping scheduled publish")
-            return
-        rows = fetchall(
-            "SELECT id, draft_id, run_at "
-            "FROM schedules "
-            "WHERE status='pending' "
-            "  AND run_at <= strftime('%Y-%m-%d %H:%M:%S','now','localtime') "
-            "ORDER BY run_at ASC, id ASC "
-            "LIMIT 50"
+def wake_scheduler():
+    """Слоты изменились (создан/отменён) — пересчитать ближайший run_at сейчас, а не по таймеру."""
+    if _wake is not None:
+        _wake.set()
+
+def _retry_delay(attempts: int, retry_after: float | None = None) -> float:
+    delay = min(PUBLISH_RETRY_BASE * 2 ** max(0, attempts - 1), PUBLISH_RETRY_MAX)
+    return max(delay, float(retry_after or 0))
+
+def _fail_slot(sid: int, error: str, permanent: bool, retry_after: float | None):
+    """
+    Попытка не удалась: перенести run_at с паузой либо (попытки кончились/ошибка постоянная) — в 'dead'.
+    Слот, отменённый или перехваченный другим экземпляром во время публикации, не трогаем.
+    """
+    row = fetchone("SELECT attempts FROM schedules WHERE id=?", (sid,))
+    attempts = (row[0] if row else 0) + 1
+    if permanent or attempts >= PUBLISH_MAX_ATTEMPTS:
+        cur = execute(
+            "UPDATE schedules SET status='dead', attempts=?, last_error=?, lease_owner=NULL, lease_until=NULL "
+            "WHERE id=? AND status='running' AND lease_owner=?",
+            (attempts, error, sid, INSTANCE_ID),
         )
-        for sid, draft_id, _ in rows:
+        if not cur.rowcount:
+            log.warning("Slot %s failed but is no longer ours: %s", sid, error)
+            return
+        log.error("Slot %s is dead after %s attempt(s): %s", sid, attempts, error)
+        return
+    delay = _retry_delay(attempts, retry_after)
+    cur = execute(
+        "UPDATE schedules SET status='pending', attempts=?, last_error=?, lease_owner=NULL, lease_until=NULL, "
+        "run_at=strftime('%Y-%m-%d %H:%M:%S','now','localtime',?) "
+        "WHERE id=? AND status='running' AND lease_owner=?",
+        (attempts, error, f"+{int(delay)} seconds", sid, INSTANCE_ID),
+    )
+    if not cur.rowcount:
+        log.warning("Slot %s failed but is no longer ours: %s", sid, error)
+        return
+    log.warning("Slot %s failed (attempt %s), retry in %ss: %s", sid, attempts, int(delay), error)
+
+def claim_slot(sid: int, default_channel: int, statuses: tuple = ("pending",)) -> bool:
+    """
+    Атомарно захватить слот (status -> 'running', lease на PUBLISH_LEASE_SEC).
+    False — слот уже не в statuses (взял другой экземпляр/отменён) или в том же канале
+    сейчас публикует другой экземпляр: порядок постов внутри канала сохраняется.
+    default_channel — общий канал (для черновиков без drafts.channel_id).
+    """
+    now = int(time.time())
+    marks = ",".join("?" * len(statuses))
+    rows = fetchall(
+        "UPDATE schedules SET status='running', lease_owner=?, lease_until=? "
+        f"WHERE id=? AND status IN ({marks}) "
+        "  AND NOT EXISTS ("
+        "    SELECT 1 FROM schedules r LEFT JOIN drafts rd ON rd.id = r.draft_id "
+        "    WHERE r.status='running' AND r.lease_until >= ? AND r.id != schedules.id "
+        "      AND COALESCE(rd.channel_id, ?) = ("
+        "        SELECT COALESCE(d.channel_id, ?) FROM drafts d WHERE d.id = schedules.draft_id)"
+        "  ) "
+        "RETURNING id",
+        (INSTANCE_ID, now + PUBLISH_LEASE_SEC, sid, *statuses, now, default_channel, default_channel),
+    )
+    return bool(rows)
+
+def _recover_leases(own: bool = False) -> int:
+    """Вернуть в 'pending' слоты с просроченным захватом (own=True — ещё и все свои: мы перезапустились)."""
+    cur = execute(
+        "UPDATE schedules SET status='pending', lease_owner=NULL, lease_until=NULL "
+        "WHERE status='running' AND (COALESCE(lease_until, 0) < ? OR (? AND lease_owner = ?))",
+        (int(time.time()), int(own), INSTANCE_ID),
+    )
+    if cur.rowcount:
+        log.warning("Recovered %s interrupted slot(s)", cur.rowcount)
+    return cur.rowcount
+
+def _renew_lease(sid: int) -> bool:
+    cur = execute(
+        "UPDATE schedules SET lease_until=? WHERE id=? AND status='running' AND lease_owner=?",
+        (int(time.time()) + PUBLISH_LEASE_SEC, sid, INSTANCE_ID),
+    )
+    return cur.rowcount > 0
+
+@asynccontextmanager
+async def hold_lease(sid: int):
+    """
+    Продлевать захват слота, пока идёт публикация: ожидание лимитов Telegram
+    (retry_after до max_retries раз) может длиться дольше PUBLISH_LEASE_SEC.
+    """
+    async def renew():
+        while True:
+            await asyncio.sleep(PUBLISH_LEASE_SEC / 3)
             try:
-                execute("UPDATE schedules SET status='running' WHERE id=? AND status='pending'", (sid,))
-                ok = await _publish(bot, draft_id, channel_id)
-                execute("UPDATE schedules SET status=? WHERE id=?", ("done" if ok else "canceled", sid))
+                if not await awrite(_renew_lease, sid):
+                    log.warning("Lease of slot %s lost while publishing", sid)
+                    return
             except Exception:
-                execute("UPDATE schedules SET status='canceled' WHERE id=?", (sid,))
+                log.exception("Lease renewal of slot %s failed", sid)
+
+    task = asyncio.create_task(renew())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+async def _run_slot(bot: Bot, sid: int, draft_id: int, channel_id: int,
+                    default_channel: int | None = None) -> bool:
+    """Захватить и опубликовать слот. False — слот не наш (захвачен другим экземпляром)."""
+    if not await awrite(claim_slot, sid, channel_id if default_channel is None else default_channel):
+        return False
+    try:
+        async with hold_lease(sid):
+            ok = await _publish(bot, draft_id, channel_id, schedule_id=sid)
+        if not ok:
+            await atransaction(_fail_slot, sid, "draft not found or unsupported content", True, None)
+    except TelegramRetryAfter as e:
+        await atransaction(_fail_slot, sid, f"flood control: retry after {e.retry_after}s", False, e.retry_after)
+    except (TelegramBadRequest, TelegramForbiddenError) as e:
+        # неверный file_id, нет прав в канале и т.п. — повтор не поможет
+        await atransaction(_fail_slot, sid, str(e)[:500], True, None)
+    except Exception as e:
+        log.exception("Scheduled publish of slot %s failed", sid)
+        await atransaction(_fail_slot, sid, f"{type(e).__name__}: {e}"[:500], False, None)
+    return True
+
+async def _run_due(bot: Bot, channel_id: int) -> tuple[int, int]:
+    """
+    Опубликовать все наступившие слоты (пачками по 50). Слоты группируются по целевому
+    каналу (drafts.channel_id или общий): каналы — параллельно, внутри канала — по порядку.
+    Каждый слот перед публикацией захватывается (claim_slot); если канал занят другим
+    экземпляром, остаток канала откладывается до следующего прохода.
+    Возвращает (обработано, отложено).
+    """
+    total = skipped = 0
+    sem = asyncio.Semaphore(PUBLISH_CONCURRENCY)
+
+    async def run_channel(chat_id: int, slots: list):
+        nonlocal total, skipped
+        async with sem:
+            for i, (sid, draft_id) in enumerate(slots):
+                if not await _run_slot(bot, sid, draft_id, chat_id, channel_id):
+                    skipped += len(slots) - i
+                    return
+                total += 1
+
+    while True:
+        rows = await afetchall(
+            "SELECT s.id, s.draft_id, d.channel_id "
+            "FROM schedules s LEFT JOIN drafts d ON d.id = s.draft_id "
+            "WHERE s.status='pending' "
+            "  AND s.run_at <= strftime('%Y-%m-%d %H:%M:%S','now','localtime') "
+            "ORDER BY s.run_at ASC, s.id ASC "
+            "LIMIT 50"
+        )
+        by_channel: dict[int, list] = {}
+        for sid, draft_id, draft_channel in rows:
+            by_channel.setdefault(draft_channel or channel_id, []).append((sid, draft_id))
+        await asyncio.gather(*(run_channel(ch, slots) for ch, slots in by_channel.items()))
+        # отложенные слоты остаются pending — следующая пачка выбрала бы их снова
+        if len(rows) < 50 or skipped:
+            return total, skipped
 
-    sched.add_job(tick, "interval", seconds=10, id="publisher_tick", replace_existing=True)
-    sched.start()
-    return sched
+async def _next_delay() -> float:
+    """Секунд до ближайшего pending-слота или истечения чужого захвата (не больше SCHEDULER_SWEEP_SEC)."""
+    row = await afetchone(
+        "SELECT (SELECT MIN(run_at) FROM schedules WHERE status='pending'), "
+        "(SELECT MIN(lease_until) FROM schedules WHERE status='running')"
+    )
+    delay = SCHEDULER_SWEEP_SEC
+    if row and row[1] is not None:
+        delay = min(delay, int(row[1]) - time.time() + 1)
+    if row and row[0]:
+        try:
+            # run_at — локальное время, как и strftime(...,'localtime') в выборке
+            run_at = datetime.strptime(str(row[0])[:19], "%Y-%m-%d %H:%M:%S")
+            # +10 мс: run_at с точностью до секунды, просыпаемся уже после её начала
+            delay = min(delay, (run_at - datetime.now()).total_seconds() + 0.01)
+        except ValueError:
+            pass
+    return min(max(delay, 0.05), SCHEDULER_SWEEP_SEC)
+
+async def _publisher_loop(bot: Bot):
+    own = True  # первый проход после старта: наши 'running' остались от прошлого запуска
+    while True:
+        # сброс до выборки: wake_scheduler() во время публикации не потеряется
+        _wake.clear()
+        delay = SCHEDULER_SWEEP_SEC
+        try:
+            await awrite(_recover_leases, own)
+            own = False
+            channel_id = get_channel_id()
+            if channel_id is None:
+                log.error("No channel_id configured; skipping scheduled publish")
+            else:
+                _, skipped = await _run_due(bot, channel_id)
+                delay = await _next_delay()
+                if skipped:
+                    delay = max(delay, _BUSY_RECHECK_SEC)
+        except Exception:
+            log.exception("Publisher loop error")
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
 
-async def publish_now(bot: Bot, draft_id: int) -> bool:
-    """Быстрая публикация — не трогаем слоты."""
+def setup_scheduler(bot: Bot) -> asyncio.Task:
+    """
+    Публикатор по расписанию: спит до ближайшего run_at (или до wake_scheduler()),
+    публикует наступившие слоты. Вызывать из работающего event loop.
+    """
+    global _wake
+    _wake = asyncio.Event()
+    return asyncio.create_task(_publisher_loop(bot), name="publisher")
+
+async def publish_now(bot: Bot, draft_id: int, schedule_id: int | None = None) -> bool:
+    """Быстрая публикация — слоты не трогаем, кроме явно переданного schedule_id."""
     channel_id = get_channel_id()
     if channel_id is None:
         log.error("No channel_id configured; skipping immediate publish of draft %s", draft_id)
         return False
-    return await _publish(bot, draft_id, channel_id)
+    # собранный пост мог остаться в publish_payloads — удалённый черновик не публикуем
+    row = await afetchone("SELECT status FROM drafts WHERE id=?", (draft_id,))
+    if not row or row[0] == "deleted":
+        return False
+    return await _publish(bot, draft_id, channel_id, schedule_id=schedule_id)
 
 # ------------ helpers ------------
 def _escape_html(s: str) -> str:
@@ -65,9 +279,8 @@ def _escape_html(s: str) -> str:
 
 def _trailing_values() -> tuple[str, str]:
     """Получить хвост ссылки и текст из настроек."""
-    url = (get_setting("TRAILING_URL") or "").strip()
-    text = (get_setting("TRAILING_TEXT") or "").strip()
-    return url, text
+    vals = get_settings(("TRAILING_URL", "TRAILING_TEXT"))
+    return (vals["TRAILING_URL"] or "").strip(), (vals["TRAILING_TEXT"] or "").strip()
 
 def _render_html(body: str) -> str:
     safe = _escape_html(body or "")
@@ -103,92 +316,151 @@ def _build_keyboard(buttons_json: str | None) -> InlineKeyboardMarkup | None:
     except Exception:
         return None
 
+def _mark_published(draft_id: int, schedule_id: int | None):
+    execute("UPDATE drafts SET status='published', published_at=CURRENT_TIMESTAMP WHERE id=?", (draft_id,))
+    if schedule_id is not None:
+        # только свой захват: отменённый или перехваченный слот не завершается повторно
+        execute(
+            "UPDATE schedules SET status='done', lease_owner=NULL, lease_until=NULL "
+            "WHERE id=? AND status='running' AND lease_owner=?",
+            (schedule_id, INSTANCE_ID),
+        )
+    # у черновика больше нет слотов в очереди — собранный пост не нужен
+    if not fetchone("SELECT 1 FROM schedules WHERE draft_id=? AND status IN ('pending','dead') LIMIT 1", (draft_id,)):
+        execute("DELETE FROM publish_payloads WHERE draft_id=?", (draft_id,))
+
 # ------------ publish ------------
-async def _publish(bot: Bot, draft_id: int, channel_id: int | None):
-    if channel_id is None:
-        return False
+# готовый пост хранится в publish_payloads: шаги отправки с уже собранными HTML, подписями,
+# клавиатурой и списком медиа. Собирается при постановке в очередь/правке, на публикации —
+# только «прочитать и отправить». Смена хвоста-ссылки меняет fingerprint — пересборка при отправке
+_MEDIA_TYPES = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
+
+def _tail_fingerprint() -> str:
+    url, text = _trailing_values() if RSS_INCLUDE_LINK else ("", "")
+    return f"{int(RSS_INCLUDE_LINK)}\x1f{url}\x1f{text}"
+
+def _compile_payload(draft_id: int) -> dict | None:
+    """Собрать шаги отправки черновика; None — черновика нет (или удалён) или тип не поддерживается."""
     import json
     row = fetchone(
-        "SELECT content_type, text, parse_mode, disable_web_page_preview, silent, "
-        "media_file_id, media_url, album_json, buttons_json "
-        "FROM drafts WHERE id=?",
+        "SELECT content_type, text, silent, media_file_id, media_url, album_json, buttons_json, channel_id "
+        "FROM drafts WHERE id=? AND status != 'deleted'",
         (draft_id,)
     )
     if not row:
-        return False
-
-    content_type, text, _parse_mode, disable_preview, silent, media_file_id, media_url, album_json, buttons_json = row
-    chat_id = channel_id
+        return None
+    content_type, text, silent, media_file_id, media_url, album_json, buttons_json, draft_channel = row
     kb = _build_keyboard(buttons_json)
     html = _render_html(text or "")
+    message = {"m": "message", "text": html[:4096], "html": True, "kb": True}
+    steps = []
 
-    # Текст
     if content_type == "text":
-        await bot.send_message(
-            chat_id, html[:4096],
-            disable_web_page_preview=True,
-            disable_notification=bool(silent),
-            reply_markup=kb,
-            parse_mode="HTML",
-        )
+        steps.append(message)
 
-    # Одиночное медиа
-    elif content_type in ("photo", "video", "document"):
+    elif content_type in _MEDIA_TYPES:
         cap = html if len(html) <= 1024 else None
-        file_ref = media_file_id or media_url
-        if content_type == "photo":
-            await bot.send_photo(chat_id, file_ref, caption=cap,
-                                 disable_notification=bool(silent), reply_markup=kb if cap else None,
-                                 parse_mode="HTML" if cap else None)
-        elif content_type == "video":
-            await bot.send_video(chat_id, file_ref, caption=cap,
-                                 disable_notification=bool(silent), reply_markup=kb if cap else None,
-                                 parse_mode="HTML" if cap else None)
-        else:
-            await bot.send_document(chat_id, file_ref, caption=cap,
-                                    disable_notification=bool(silent), reply_markup=kb if cap else None,
-                                    parse_mode="HTML" if cap else None)
+        steps.append({"m": content_type, "file": media_file_id or media_url, "caption": cap, "kb": bool(cap)})
         if not cap:
             # остаток текстом (лимит Telegram)
-            await bot.send_message(
-                chat_id, html[:4096],
-                disable_web_page_preview=True,
-                disable_notification=bool(silent),
-                reply_markup=kb,
-                parse_mode="HTML",
-            )
+            steps.append(message)
 
-    # Альбом
     elif content_type == "album":
         try:
             items = json.loads(album_json or "[]")
         except Exception:
             items = []
         if not items:
-            await bot.send_message(chat_id, "(пустой альбом)", disable_notification=bool(silent), reply_markup=kb)
+            steps.append({"m": "message", "text": "(пустой альбом)", "html": False, "kb": True})
         else:
-            use_caption = html and len(html) <= 1024
-            media = []
-            for i, it in enumerate(items):
-                cap = html if (i == 0 and use_caption) else None
-                t, fid = it["type"], it["file_id"]
-                if t == "photo":
-                    media.append(InputMediaPhoto(media=fid, caption=cap, parse_mode="HTML" if cap else None))
-                elif t == "video":
-                    media.append(InputMediaVideo(media=fid, caption=cap, parse_mode="HTML" if cap else None))
-                else:
-                    media.append(InputMediaDocument(media=fid, caption=cap, parse_mode="HTML" if cap else None))
-            await bot.send_media_group(chat_id, media=media, disable_notification=bool(silent))
+            use_caption = bool(html) and len(html) <= 1024
+            media = [
+                {"type": it["type"], "media": it["file_id"], "caption": html if (i == 0 and use_caption) else None}
+                for i, it in enumerate(items)
+            ]
+            steps.append({"m": "media_group", "media": media})
             if not use_caption or kb:
-                await bot.send_message(
-                    chat_id, html[:4096],
-                    disable_web_page_preview=True,
-                    disable_notification=bool(silent),
-                    reply_markup=kb,
-                    parse_mode="HTML",
-                )
+                steps.append(message)
     else:
+        return None
+
+    return {
+        "channel": draft_channel,
+        "silent": bool(silent),
+        "markup": kb.model_dump(exclude_none=True) if kb else None,
+        "steps": steps,
+    }
+
+def _store_payload(draft_id: int) -> dict | None:
+    import json
+    payload = _compile_payload(draft_id)
+    if payload is not None:
+        execute(
+            "INSERT OR REPLACE INTO publish_payloads(draft_id, fingerprint, payload) VALUES(?,?,?)",
+            (draft_id, _tail_fingerprint(), json.dumps(payload, ensure_ascii=False)),
+        )
+    return payload
+
+def precompile_payload(draft_id: int):
+    """Пересобрать пост, если черновик стоит в очереди (вызывать после создания слота и правок)."""
+    if fetchone("SELECT 1 FROM schedules WHERE draft_id=? AND status IN ('pending','dead') LIMIT 1", (draft_id,)):
+        with transaction():
+            _store_payload(draft_id)
+
+async def _load_payload(draft_id: int) -> dict | None:
+    import json
+    row = await afetchone("SELECT fingerprint, payload FROM publish_payloads WHERE draft_id=?", (draft_id,))
+    if row and row[0] == _tail_fingerprint():
+        return json.loads(row[1])
+    # не собран заранее (быстрая публикация) или устарел — собираем под записью, без гонки с правкой
+    return await atransaction(_store_payload, draft_id)
+
+async def _send_payload(bot: Bot, chat_id: int, payload: dict, start: int = 0, schedule_id: int | None = None):
+    """Отправить шаги с номера start; для слота после каждого шага запоминаем schedules.sent_steps."""
+    silent = payload["silent"]
+    kb = InlineKeyboardMarkup.model_validate(payload["markup"]) if payload["markup"] else None
+    steps = payload["steps"]
+    for i in range(start, len(steps)):
+        step = steps[i]
+        m = step["m"]
+        if m == "message":
+            await limiter.send(
+                chat_id, bot.send_message, chat_id, step["text"],
+                disable_web_page_preview=True,
+                disable_notification=silent,
+                reply_markup=kb if step["kb"] else None,
+                parse_mode="HTML" if step["html"] else None,
+            )
+        elif m == "media_group":
+            media = [
+                _MEDIA_TYPES.get(it["type"], InputMediaDocument)(
+                    media=it["media"], caption=it["caption"], parse_mode="HTML" if it["caption"] else None
+                )
+                for it in step["media"]
+            ]
+            await limiter.send(chat_id, bot.send_media_group, chat_id, media=media, disable_notification=silent)
+        else:
+            cap = step["caption"]
+            send = getattr(bot, f"send_{m}")
+            await limiter.send(chat_id, send, chat_id, step["file"], caption=cap,
+                               disable_notification=silent, reply_markup=kb if step["kb"] else None,
+                               parse_mode="HTML" if cap else None)
+        if schedule_id is not None and i + 1 < len(steps):
+            await aexecute("UPDATE schedules SET sent_steps=? WHERE id=?", (i + 1, schedule_id))
+
+async def _publish(bot: Bot, draft_id: int, channel_id: int | None, schedule_id: int | None = None):
+    if channel_id is None:
         return False
+    payload = await _load_payload(draft_id)
+    if payload is None:
+        return False
+    start = 0
+    if schedule_id is not None:
+        # повтор после ошибки на середине поста — продолжаем с неотправленного шага
+        row = await afetchone("SELECT sent_steps FROM schedules WHERE id=?", (schedule_id,))
+        start = row[0] if row else 0
+    await _send_payload(bot, payload["channel"] or channel_id, payload, start, schedule_id)
 
-    execute("UPDATE drafts SET status='published', published_at=CURRENT_TIMESTAMP WHERE id=?", (draft_id,))
+    # статус черновика и слота меняются атомарно
+    await atransaction(_mark_published, draft_id, schedule_id)
     return True
@@ -0,0 +1,103 @@
+"""
+Разбор тела ленты в готовые записи: XML-парсер (с regex-запасным путём) + очистка текста.
+Без зависимостей от бота/БД — функции можно выполнять в пуле процессов (parse_body).
+"""
+import html
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .feed_parser import FeedParser, ParseError, parse_feed
+
+# порядок полей в компактных кортежах parse_body
+ITEM_FIELDS = ("title", "link", "guid", "pubdate", "summary", "html", "media_url")
+
+
+def text_clean(s: str) -> str:
+    if not s:
+        return ""
+    # Уберем html-теги
+    s = re.sub(r"<[^>]+>", "", s)
+    # Раскодируем HTML-сущности
+    s = html.unescape(s)
+    # Удалим &nbsp; и другие невидимые символы
+    s = re.sub(r"[\u00A0\u200B-\u200D\uFEFF]", " ", s)
+    # Сжимаем лишние пробелы
+    s = re.sub(r"\s+", " ", s, flags=re.M).strip()
+    return s
+
+def _xml_findall(text: str, tag: str) -> List[str]:
+    # очень простой извлекатель <tag>...</tag> из RSS (чтобы не тянуть лишние зависимости)
+    # не идеален, но для большинства лент работает
+    pat = re.compile(rf"<{tag}[^>]*>(.*?)</{tag}>", re.I | re.S)
+    return pat.findall(text or "")
+
+def _xml_first(text: str, tag: str) -> Optional[str]:
+    arr = _xml_findall(text, tag)
+    return arr[0] if arr else None
+
+def clean_item(it: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "title": text_clean(it.get("title") or ""),
+        "link": it.get("link") or "",
+        "guid": it.get("guid") or "",
+        "pubdate": it.get("pubdate"),
+        "summary": text_clean(it.get("description") or ""),
+        "html": it.get("description") or "",
+        "media_url": it.get("media_url"),
+    }
+
+def extract_items_regex(rss_xml: str) -> List[Dict[str, Any]]:
+    """Прежний regex-извлекатель — запасной путь для лент, которые не парсятся как XML."""
+    # Ищем block <item>...</item>
+    items_raw = re.findall(r"<item\b.*?</item>", rss_xml or "", re.I | re.S)
+    items: List[Dict[str, Any]] = []
+    for raw in items_raw:
+        title = _xml_first(raw, "title") or ""
+        link = _xml_first(raw, "link") or ""
+        guid = _xml_first(raw, "guid") or ""
+        pubdate = _xml_first(raw, "pubDate") or _xml_first(raw, "published") or _xml_first(raw, "updated")
+        description = _xml_first(raw, "description") or ""
+        media_url = None
+        for tag in ("enclosure", "media:content"):
+            m = re.search(rf"<{tag}[^>]+?(?:url|href)=['\"]([^'\"]+)['\"]", raw, re.I)
+            if m:
+                media_url = m.group(1).strip()
+                break
+        items.append({
+            "title": text_clean(title),
+            "link": link.strip(),
+            "guid": guid.strip(),
+            "pubdate": pubdate.strip() if pubdate else None,
+            "summary": text_clean(description),
+            "html": description,
+            "media_url": media_url,
+        })
+    return items
+
+def extract_items(rss_xml: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """RSS 2.0 / Atom из готового текста; при невалидном XML — regex-извлекатель."""
+    try:
+        return [clean_item(it) for it in parse_feed(rss_xml, limit)]
+    except ParseError:
+        items = extract_items_regex(rss_xml)
+        return items[:limit] if limit else items
+
+
+def parse_body(data: bytes, encoding: Optional[str], limit: Optional[int]) -> Tuple[List[tuple], Dict[str, str]]:
+    """
+    Тело ленты целиком -> (кортежи ITEM_FIELDS, meta канала). Обрезанное по лимиту тело
+    допустимо: уже закрытые элементы сохраняются, ошибка на хвосте игнорируется.
+    """
+    parser = FeedParser(limit)
+    found: List[Dict[str, Any]] = []
+    try:
+        found += parser.feed(data)
+        if not parser.done:
+            found += parser.close()
+    except ParseError:
+        if not found:
+            text = data.decode(encoding or "utf-8", errors="replace")
+            items = extract_items_regex(text)
+            items = items[:limit] if limit else items
+            return [tuple(it[f] for f in ITEM_FIELDS) for it in items], {}
+    return [tuple(clean_item(it)[f] for f in ITEM_FIELDS) for it in found], dict(parser.meta)
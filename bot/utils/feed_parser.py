@@ -0,0 +1,132 @@
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional
+
+ATOM_NS = "http://www.w3.org/2005/Atom"
+MEDIA_NS = "http://search.yahoo.com/mrss/"
+CONTENT_NS = "http://purl.org/rss/1.0/modules/content/"
+DC_NS = "http://purl.org/dc/elements/1.1/"
+SY_NS = "http://purl.org/rss/1.0/modules/syndication/"
+RSS1_NS = "http://purl.org/rss/1.0/"
+
+ParseError = ET.ParseError
+
+
+def _local(tag: str) -> tuple[str, str]:
+    """'{ns}name' -> (ns, name)."""
+    if tag[:1] == "{":
+        ns, _, name = tag[1:].partition("}")
+        return ns, name
+    return "", tag
+
+
+class FeedParser:
+    """
+    Инкрементальный разбор RSS 2.0 / RSS 1.0 / Atom.
+    - feed(chunk) принимает байты по мере прихода из HTTP и возвращает уже закрытые элементы;
+    - разобранные <item>/<entry> сразу удаляются из дерева — память не растёт с размером ленты;
+    - после limit элементов done=True, дальше читать поток не нужно.
+    Значения отдаются «как есть» (HTML/CDATA не чистится) — очистка на стороне вызывающего.
+    В meta собираются подсказки канала: ttl, sy:updatePeriod/updateFrequency.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._stack: List[ET.Element] = []
+        self._limit = limit
+        self.count = 0
+        self.done = False
+        self.meta: Dict[str, str] = {}
+
+    def feed(self, data: bytes | str) -> List[Dict[str, Any]]:
+        if self.done:
+            return []
+        self._parser.feed(data)
+        return self._drain()
+
+    def close(self) -> List[Dict[str, Any]]:
+        if self.done:
+            return []
+        self._parser.close()
+        return self._drain()
+
+    # ------------ internals ------------
+    def _drain(self) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                self._stack.append(elem)
+                continue
+            self._stack.pop()
+            ns, name = _local(elem.tag)
+            if name in ("item", "entry") and ns in ("", ATOM_NS, RSS1_NS):
+                out.append(self._item(elem, ns == ATOM_NS))
+                if self._stack:
+                    self._stack[-1].remove(elem)
+                self.count += 1
+                if self._limit is not None and self.count >= self._limit:
+                    self.done = True
+                    break
+            elif len(self._stack) <= 2:
+                # уровень канала: подсказки частоты обновления
+                if name == "ttl" and ns == "":
+                    self.meta["ttl"] = (elem.text or "").strip()
+                elif ns == SY_NS and name in ("updatePeriod", "updateFrequency"):
+                    self.meta[name] = (elem.text or "").strip()
+        return out
+
+    @staticmethod
+    def _item(elem: ET.Element, atom: bool) -> Dict[str, Any]:
+        title = link = guid = pubdate = description = content = ""
+        media_url = None
+        for child in elem:
+            ns, name = _local(child.tag)
+            text = child.text or ""
+            if name == "title" and not title:
+                title = "".join(child.itertext())
+            elif name == "link" and ns in ("", ATOM_NS, RSS1_NS):
+                href = child.get("href")
+                if href is not None:
+                    # Atom: берём rel=alternate (или без rel), вложения — как медиа
+                    rel = child.get("rel", "alternate")
+                    if rel == "alternate" and not link:
+                        link = href
+                    elif rel == "enclosure" and not media_url:
+                        media_url = href
+                elif not link:
+                    link = text
+            elif name in ("guid", "id") and not guid:
+                guid = text
+            elif name in ("pubDate", "published", "updated", "date") and not pubdate:
+                pubdate = text
+            elif name in ("description", "summary") and not description:
+                description = "".join(child.itertext())
+            elif (name == "encoded" and ns == CONTENT_NS) or (name == "content" and ns == ATOM_NS):
+                content = content or "".join(child.itertext())
+            elif name == "enclosure" or (ns == MEDIA_NS and name in ("content", "thumbnail")):
+                url = child.get("url") or child.get("href")
+                if url and not media_url:
+                    media_url = url.strip()
+            elif ns == MEDIA_NS and name == "group" and not media_url:
+                for sub in child:
+                    if _local(sub.tag)[1] in ("content", "thumbnail"):
+                        url = sub.get("url")
+                        if url:
+                            media_url = url.strip()
+                            break
+        return {
+            "title": title,
+            "link": link.strip(),
+            "guid": guid.strip(),
+            "pubdate": pubdate.strip() or None,
+            "description": description or content,
+            "media_url": media_url,
+        }
+
+
+def parse_feed(data: bytes | str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Разобрать документ целиком (тот же FeedParser, одним куском)."""
+    p = FeedParser(limit)
+    items = p.feed(data)
+    if not p.done:
+        items += p.close()
+    return items
@@ -0,0 +1,36 @@
+import hashlib
+from typing import Iterable
+
+
+class SeenIndex:
+    """
+    Индекс уже виденных хешей черновиков в памяти.
+    - хранит 64-битный префикс хеша (int), а не 64-символьную строку — ~3 раза меньше памяти;
+    - промах — запись точно новая (если индекс прогрет);
+    - попадание — «возможно видели»: вызывающий подтверждает одним запросом WHERE hash IN (...).
+    """
+
+    def __init__(self):
+        self._keys: set[int] = set()
+        self.warmed = False
+
+    @staticmethod
+    def key(hash_hex: str) -> int:
+        try:
+            return int(hash_hex[:16], 16)
+        except ValueError:
+            # не-hex хеш (старые/ручные записи) — сворачиваем в те же 64 бита
+            return int.from_bytes(hashlib.blake2b(hash_hex.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def warm(self, hashes: Iterable[str]):
+        self._keys.update(self.key(h) for h in hashes if h)
+        self.warmed = True
+
+    def add(self, hash_hex: str):
+        self._keys.add(self.key(hash_hex))
+
+    def __contains__(self, hash_hex: str) -> bool:
+        return self.key(hash_hex) in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
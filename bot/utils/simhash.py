@@ -0,0 +1,53 @@
+import hashlib
+import re
+from collections import Counter
+from typing import List
+
+BITS = 64
+# 6 полос (4 по 11 бит + 2 по 10): при расстоянии <= 5 хотя бы одна полоса совпадает целиком
+# (принцип Дирихле). На коротких анонсах замена одного слова даёт 3-5 бит разницы.
+BANDS = 6
+MAX_DISTANCE = BANDS - 1
+_WIDTHS = [BITS // BANDS + (1 if i < BITS % BANDS else 0) for i in range(BANDS)]
+_OFFSETS = [sum(_WIDTHS[:i]) for i in range(BANDS)]
+
+_WORD = re.compile(r"\w+", re.U)
+
+
+def _features(text: str) -> Counter:
+    # только слова (без n-грамм): на коротких анонсах пары слов делают хеш слишком чувствительным
+    return Counter(w for w in _WORD.findall(text.lower()) if len(w) > 1)
+
+
+def simhash(text: str, min_words: int = 3) -> int | None:
+    """64-битный SimHash текста; None — слишком короткий текст (сравнение было бы шумом)."""
+    feats = _features(text or "")
+    if sum(feats.values()) < min_words:
+        return None
+    acc = [0] * BITS
+    for feat, weight in feats.items():
+        h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "big")
+        for i in range(BITS):
+            acc[i] += weight if (h >> i) & 1 else -weight
+    out = 0
+    for i in range(BITS):
+        if acc[i] > 0:
+            out |= 1 << i
+    return out
+
+
+def hamming(a: int, b: int) -> int:
+    return ((a ^ b) & ((1 << BITS) - 1)).bit_count()
+
+
+def bands(h: int) -> List[int]:
+    return [(h >> off) & ((1 << w) - 1) for off, w in zip(_OFFSETS, _WIDTHS)]
+
+
+def to_signed(h: int) -> int:
+    """SQLite INTEGER — знаковый 64-битный."""
+    return h - (1 << BITS) if h >= 1 << (BITS - 1) else h
+
+
+def from_signed(h: int) -> int:
+    return h & ((1 << BITS) - 1)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict
+
+from aiogram.exceptions import TelegramRetryAfter
+
+log = logging.getLogger(__name__)
+
+
+class _Bucket:
+    """Token bucket с резервированием: take() сразу списывает токен и говорит, сколько подождать."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.cap = burst
+        self.tokens = burst
+        self.ts = time.monotonic()
+
+    def take(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.cap, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class TelegramLimiter:
+    """
+    Отправка в Telegram с учётом лимитов Bot API:
+    - общий поток сообщений бота (global_rate в секунду);
+    - личные чаты — chat_rate в секунду, группы/каналы (отрицательный chat_id) — group_rate
+      с запасом group_burst (пост с медиа — это 2 вызова подряд);
+    - TelegramRetryAfter: пауза на retry_after для всех отправок и повтор (до max_retries раз).
+    """
+
+    def __init__(self, global_rate: float = 25.0, chat_rate: float = 1.0,
+                 group_rate: float = 20 / 60, group_burst: float = 3, max_retries: int = 3):
+        self._global = _Bucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._chats: Dict[int, _Bucket] = {}
+        self._paused_until = 0.0
+        self.max_retries = max_retries
+
+    def _chat(self, chat_id: int) -> _Bucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            if chat_id < 0:
+                b = _Bucket(self._group_rate, self._group_burst)
+            else:
+                b = _Bucket(self._chat_rate, 1)
+            self._chats[chat_id] = b
+        return b
+
+    async def _acquire(self, chat_id: int):
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        wait = max(self._global.take(), self._chat(chat_id).take())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def send(self, chat_id: int, fn, *args, **kwargs):
+        """await fn(*args, **kwargs) в рамках лимитов чата chat_id."""
+        attempt = 0
+        while True:
+            await self._acquire(chat_id)
+            try:
+                return await fn(*args, **kwargs)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                # flood control касается всего бота — притормаживаем все отправки
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                log.warning("Telegram flood control: retry after %ss (chat %s)", e.retry_after, chat_id)
+
+
+# общий экземпляр на процесс: все отправки бота делят один бюджет
+limiter = TelegramLimiter(
+    global_rate=float(os.getenv("TG_RATE_GLOBAL", "25")),
+    chat_rate=float(os.getenv("TG_RATE_CHAT", "1")),
+    group_rate=float(os.getenv("TG_RATE_GROUP_PER_MIN", "20")) / 60,
+    group_burst=float(os.getenv("TG_BURST_GROUP", "3")),
+)
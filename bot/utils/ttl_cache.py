@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Tuple
+
+
+class TTLCache:
+    """
+    Небольшой LRU-кэш в памяти со сроком жизни записей.
+    - None — допустимое значение (отрицательный результат тоже кэшируется),
+      поэтому lookup() возвращает пару (найдено, значение);
+    - при переполнении вытесняется давно не использованная запись.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._maxsize = maxsize
+        self._ttl = ttl
+
+    def lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        item = self._data.get(key)
+        if item is None:
+            return False, None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        found, value = self.lookup(key)
+        return value if found else default
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self._ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
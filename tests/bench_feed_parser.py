@@ -0,0 +1,73 @@
+"""
+Бенчмарк: прежний regex-извлекатель против потокового FeedParser на многомегабайтной ленте.
+
+    python tests/bench_feed_parser.py [items] [desc_bytes]
+
+Не собирается pytest'ом (имя не test_*). Печатает время и пиковую память каждого варианта.
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+
+from bot import rss_worker as rw  # noqa: E402
+from bot.utils.feed_parser import FeedParser  # noqa: E402
+from bot.utils.feed_items import clean_item, extract_items_regex  # noqa: E402
+
+
+def make_feed(n_items: int, desc_bytes: int) -> bytes:
+    body = ("Lorem ipsum <b>dolor</b> sit amet, consectetur adipiscing elit. " * (desc_bytes // 64 + 1))[:desc_bytes]
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n'
+             '<rss xmlns:media="http://search.yahoo.com/mrss/"><channel><title>bench</title>']
+    for i in range(n_items):
+        parts.append(
+            f"<item><title>Item {i}</title><link>http://example.com/{i}</link><guid>g{i}</guid>"
+            f"<pubDate>Mon, 01 Sep 2025 10:00:00 +0000</pubDate>"
+            f"<description><![CDATA[{body}]]></description>"
+            f'<media:content url="http://example.com/{i}.jpg"/></item>'
+        )
+    parts.append("</channel></rss>")
+    return "".join(parts).encode("utf-8")
+
+
+def run(name, fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    n = fn()
+    dt = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<34} {dt * 1000:9.1f} ms   peak {peak / 1e6:7.1f} MB   items {n}")
+
+
+def streamed(data: bytes, limit, chunk=64 * 1024) -> int:
+    p = FeedParser(limit=limit)
+    got = []
+    for i in range(0, len(data), chunk):
+        got += [clean_item(it) for it in p.feed(data[i:i + chunk])]
+        if p.done:
+            break
+    else:
+        got += [clean_item(it) for it in p.close()]
+    return len(got)
+
+
+def main():
+    n_items = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    desc_bytes = int(sys.argv[2]) if len(sys.argv) > 2 else 1500
+    data = make_feed(n_items, desc_bytes)
+    text = data.decode("utf-8")
+    print(f"feed: {len(data) / 1e6:.1f} MB, {n_items} items")
+    run("regex (old), all items", lambda: len(extract_items_regex(text)))
+    run("regex (old), then [:10]", lambda: len(extract_items_regex(text)[:rw.MAX_ITEMS_PER_CYCLE]))
+    run("FeedParser, all items", lambda: streamed(data, None))
+    run(f"FeedParser, stop at {rw.MAX_ITEMS_PER_CYCLE}", lambda: streamed(data, rw.MAX_ITEMS_PER_CYCLE))
+
+
+if __name__ == "__main__":
+    main()
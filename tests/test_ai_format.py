@@ -0,0 +1,136 @@
+import os
+import json
+import tempfile
+import importlib
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("openai")
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+
+class _Stub(BaseHTTPRequestHandler):
+    # минимальный OpenAI-совместимый /chat/completions
+    calls = []
+    fail = False
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        _Stub.calls.append(body["messages"][1]["content"])
+        if _Stub.fail:
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": {"message": "boom"}}')
+            return
+        out = json.dumps({
+            "id": "x", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "AI: " + body["messages"][1]["content"]}}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def ai_module():
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATA_DIR"] = tmpdir
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    os.environ["OPENAI_API_KEY"] = "test"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{srv.server_address[1]}/v1"
+
+    import bot.db as db
+    importlib.reload(db)
+    db.init_db()
+    db.set_setting("AI_PROMPT", "format it")
+
+    import bot.ai_format as ai
+    importlib.reload(ai)
+    yield ai, db
+    srv.shutdown()
+    del os.environ["OPENAI_API_KEY"], os.environ["OPENAI_BASE_URL"]
+
+
+def test_format_cached_and_deduplicated(ai_module):
+    import asyncio
+    ai, db = ai_module
+    _Stub.calls.clear()
+
+    async def go():
+        first = await asyncio.gather(*(ai.format_text("same story") for _ in range(3)))
+        again = await ai.format_text("same story")
+        return first, again
+
+    first, again = asyncio.run(go())
+    assert first == ["AI: same story"] * 3 and again == "AI: same story"
+    assert _Stub.calls == ["same story"]
+    assert db.fetchone("SELECT COUNT(*) FROM ai_cache") == (1,)
+
+
+def test_old_cache_entries_pruned(ai_module, monkeypatch):
+    import asyncio
+    ai, db = ai_module
+    db.execute("INSERT INTO ai_cache(key, model, output, created_at) VALUES('old', 'm', 'x', datetime('now', '-40 days'))")
+    db.execute("INSERT INTO ai_cache(key, model, output) VALUES('fresh', 'm', 'y')")
+    monkeypatch.setattr(ai, "AI_CACHE_DAYS", 30)
+    monkeypatch.setattr(ai, "_last_prune", 0.0)
+    assert asyncio.run(ai.maybe_prune_cache()) == 1
+    assert db.fetchone("SELECT 1 FROM ai_cache WHERE key='old'") is None
+    assert db.fetchone("SELECT 1 FROM ai_cache WHERE key='fresh'") == (1,)
+    # следующий проход в пределах часа не чистит повторно
+    db.execute("INSERT INTO ai_cache(key, model, output, created_at) VALUES('old2', 'm', 'x', datetime('now', '-40 days'))")
+    assert asyncio.run(ai.maybe_prune_cache()) == 0
+
+
+def test_breaker_opens_after_failures(ai_module, monkeypatch):
+    import asyncio
+    ai, _ = ai_module
+    monkeypatch.setattr(ai, "AI_BREAKER_FAILS", 2)
+    monkeypatch.setattr(ai, "AI_MAX_RETRIES", 0)
+    monkeypatch.setattr(ai, "_breaker", ai._Breaker())
+    monkeypatch.setattr(_Stub, "fail", True)
+    _Stub.calls.clear()
+
+    async def go():
+        ai._client = None  # пересоздать клиент с AI_MAX_RETRIES=0
+        soft = [await ai.format_text(f"t{i}") for i in range(2)]
+        with pytest.raises(ai.AIUnavailable):
+            await ai.format_text("t2", strict=True)
+        return soft
+
+    assert asyncio.run(go()) == ["t0", "t1"]
+    assert _Stub.calls == ["t0", "t1"]
+
+
+def test_breaker_stops_queued_requests(ai_module, monkeypatch):
+    import asyncio
+    ai, _ = ai_module
+    monkeypatch.setattr(ai, "AI_BREAKER_FAILS", 2)
+    monkeypatch.setattr(ai, "AI_MAX_RETRIES", 0)
+    monkeypatch.setattr(ai, "AI_CONCURRENCY", 1)
+    monkeypatch.setattr(ai, "_breaker", ai._Breaker())
+    monkeypatch.setattr(_Stub, "fail", True)
+    _Stub.calls.clear()
+
+    async def go():
+        ai._client = None
+        return await asyncio.gather(*(ai.format_text(f"q{i}", strict=True) for i in range(10)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(go())
+    # после двух ошибок остальные ждавшие семафор запросы до API не доходят
+    assert len(_Stub.calls) == 2
+    assert sum(isinstance(r, ai.AIUnavailable) for r in results) == 8
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import importlib
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="module")
+def db():
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATA_DIR"] = tmpdir
+
+    import bot.db as db
+    importlib.reload(db)
+    db.init_db()
+    return db
+
+
+def test_connection_reused_per_thread(db):
+    assert db.get_con() is db.get_con()
+
+    other = []
+    t = threading.Thread(target=lambda: other.append(db.get_con()))
+    t.start(); t.join()
+    assert other[0] is not db.get_con()
+
+
+def test_execute_autocommits(db):
+    db.set_setting("k", "v")
+    # отдельное соединение видит запись без явного commit()
+    import sqlite3
+    with sqlite3.connect(db.DB_PATH) as con:
+        assert con.execute("SELECT value FROM settings WHERE key='k'").fetchone() == ("v",)
+    assert db.fetchone("PRAGMA journal_mode") == ("wal",)
+
+
+def test_async_api_runs_off_loop_thread(db):
+    import asyncio
+
+    async def go():
+        await db.aexecute("INSERT INTO settings(key,value) VALUES('ak','av')")
+        row = await db.afetchone("SELECT value FROM settings WHERE key='ak'")
+        name = await db.aread(lambda: threading.current_thread().name)
+        return row, name
+
+    row, name = asyncio.run(go())
+    assert row == ("av",)
+    assert name.startswith("db-reader")
+
+
+def test_transaction_rolls_back_as_a_unit(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.execute("INSERT INTO settings(key,value) VALUES('tx1','a')")
+            with db.transaction():
+                db.executemany("INSERT INTO settings(key,value) VALUES(?,?)", [("tx2", "b"), ("tx3", "c")])
+            raise RuntimeError("boom")
+    assert db.fetchone("SELECT COUNT(*) FROM settings WHERE key LIKE 'tx%'") == (0,)
+
+    with db.transaction():
+        db.executemany("INSERT INTO settings(key,value) VALUES(?,?)", [("tx2", "b"), ("tx3", "c")])
+    assert db.fetchone("SELECT COUNT(*) FROM settings WHERE key LIKE 'tx%'") == (2,)
+
+
+def test_settings_cache_write_through_and_ttl(db, monkeypatch):
+    db.set_setting("TRAILING_URL", "http://a")
+    assert db.get_settings(["TRAILING_URL", "missing"]) == {"TRAILING_URL": "http://a", "missing": None}
+
+    # правка в обход кэша (другой процесс) не видна, пока не истёк TTL
+    db.execute("UPDATE settings SET value='http://b' WHERE key='TRAILING_URL'")
+    assert db.get_setting("TRAILING_URL") == "http://a"
+    monkeypatch.setattr(db, "SETTINGS_CACHE_TTL", 0.001)
+    import time; time.sleep(0.01)
+    assert db.get_setting("TRAILING_URL") == "http://b"
+
+    db.delete_setting("TRAILING_URL")
+    assert db.get_setting("TRAILING_URL") is None
+
+
+def test_query_stats_groups_by_normalized_sql(db):
+    db.reset_query_stats()
+    db.fetchone("SELECT value FROM settings WHERE key='a'")
+    db.fetchone("SELECT value   FROM settings WHERE key='b'")
+    db.fetchall("SELECT key FROM settings WHERE key IN (?,?,?)", ("a", "b", "c"))
+    stats = {s["sql"]: s for s in db.query_stats()}
+    assert stats["SELECT value FROM settings WHERE key=?"]["count"] == 2
+    assert stats["SELECT key FROM settings WHERE key IN (?…)"]["count"] == 1
+    assert sum(stats["SELECT value FROM settings WHERE key=?"]["hist"].values()) == 2
+
+
+def test_slow_query_logs_caller(db, monkeypatch, caplog):
+    monkeypatch.setattr(db, "DB_SLOW_MS", 0.0)
+    with caplog.at_level("WARNING", logger=db.__name__):
+        db.fetchone("SELECT 1")
+    assert "test_slow_query_logs_caller" in caplog.text
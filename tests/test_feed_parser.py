@@ -0,0 +1,60 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from bot.utils.feed_parser import FeedParser, parse_feed
+
+RSS = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss xmlns:media="http://search.yahoo.com/mrss/" xmlns:sy="http://purl.org/rss/1.0/modules/syndication/">
+<channel><title>c</title><ttl>30</ttl><sy:updatePeriod>hourly</sy:updatePeriod>
+<item><title><![CDATA[Hello <b>world</b>]]></title><link>http://e.com/1</link>
+<description><![CDATA[<p>body</p>]]></description><media:content url="http://e.com/1.jpg"/></item>
+<item><title>Second</title><link>http://e.com/2</link><enclosure url="http://e.com/2.jpg" type="image/jpeg"/></item>
+<item><title>Third</title></item>
+</channel></rss>"""
+
+ATOM = b"""<feed xmlns="http://www.w3.org/2005/Atom">
+<entry><title>A</title><id>urn:1</id><updated>2025-01-01T00:00:00Z</updated>
+<link rel="alternate" href="http://e.com/a"/><link rel="enclosure" href="http://e.com/a.png"/>
+<summary>s</summary></entry></feed>"""
+
+RDF = b"""<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns="http://purl.org/rss/1.0/"
+xmlns:dc="http://purl.org/dc/elements/1.1/">
+<channel rdf:about="http://e.com/"><title>c</title><link>http://e.com/</link></channel>
+<item rdf:about="http://e.com/r1"><title>R</title><link>http://e.com/r1</link>
+<description>d</description><dc:date>2025-01-01T00:00:00Z</dc:date></item>
+</rdf:RDF>"""
+
+
+def test_rss_cdata_media_and_channel_hints():
+    p = FeedParser()
+    items = p.feed(RSS) + p.close()
+    assert items[0]["title"] == "Hello <b>world</b>"
+    assert items[0]["description"] == "<p>body</p>"
+    assert items[0]["media_url"] == "http://e.com/1.jpg"
+    assert items[1]["media_url"] == "http://e.com/2.jpg"
+    assert p.meta == {"ttl": "30", "updatePeriod": "hourly"}
+
+
+def test_atom_entry():
+    (it,) = parse_feed(ATOM)
+    assert (it["title"], it["link"], it["guid"], it["media_url"]) == ("A", "http://e.com/a", "urn:1", "http://e.com/a.png")
+    assert it["pubdate"] == "2025-01-01T00:00:00Z" and it["description"] == "s"
+
+
+def test_rdf_item():
+    (it,) = parse_feed(RDF)
+    assert (it["title"], it["link"], it["description"]) == ("R", "http://e.com/r1", "d")
+    assert it["pubdate"] == "2025-01-01T00:00:00Z"
+
+
+def test_chunked_feed_stops_at_limit():
+    p = FeedParser(limit=2)
+    items = []
+    for i in range(0, len(RSS), 7):
+        items += p.feed(RSS[i:i + 7])
+        if p.done:
+            break
+    assert [it["title"] for it in items] == ["Hello <b>world</b>", "Second"]
+    assert p.done
@@ -0,0 +1,32 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from bot import migrations
+
+
+def _con(path):
+    return sqlite3.connect(path, isolation_level=None)
+
+
+def test_fresh_db_reaches_latest_and_is_idempotent(tmp_path):
+    con = _con(tmp_path / "fresh.db")
+    assert migrations.migrate(con) == migrations.LATEST
+    assert migrations.schema_version(con) == migrations.LATEST
+    assert "etag" in migrations._col_names(con, "feeds")
+    # повторный запуск — ничего не делает
+    assert migrations.migrate(con) == migrations.LATEST
+
+
+def test_legacy_db_gets_missing_columns(tmp_path):
+    con = _con(tmp_path / "legacy.db")
+    con.execute("CREATE TABLE drafts (id INTEGER PRIMARY KEY AUTOINCREMENT, author_id INTEGER NOT NULL, "
+                "content_type TEXT NOT NULL, text TEXT, status TEXT NOT NULL DEFAULT 'draft', "
+                "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, published_at TIMESTAMP)")
+    con.execute("INSERT INTO drafts(author_id, content_type, text) VALUES (1, 'text', 'old')")
+    migrations.migrate(con)
+    cols = migrations._col_names(con, "drafts")
+    assert {"hash", "media_url", "source_url"} <= set(cols)
+    assert con.execute("SELECT text FROM drafts").fetchall() == [("old",)]
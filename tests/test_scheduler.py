@@ -0,0 +1,334 @@
+import os
+import tempfile
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="module")
+def sched_module():
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATA_DIR"] = tmpdir
+
+    import bot.db as db
+    importlib.reload(db)
+    db.init_db()
+
+    import bot.scheduler as sched
+    importlib.reload(sched)
+    return sched, db
+
+
+def test_publisher_sleeps_until_next_slot_and_wakes_on_insert(sched_module, monkeypatch):
+    import asyncio
+    from datetime import datetime, timedelta
+    sched, db = sched_module
+    published = []
+
+    async def fake_publish(bot, draft_id, channel_id, schedule_id=None):
+        published.append((draft_id, datetime.now()))
+        await db.atransaction(sched._mark_published, draft_id, schedule_id)
+        return True
+
+    monkeypatch.setattr(sched, "_publish", fake_publish)
+    monkeypatch.setattr(sched, "get_channel_id", lambda: -100)
+    did = db.execute("INSERT INTO drafts(author_id, content_type, text) VALUES(0, 'text', 's')").lastrowid
+
+    async def go():
+        task = sched.setup_scheduler(bot=None)
+        await asyncio.sleep(0.3)
+        db.reset_query_stats()
+        await asyncio.sleep(0.5)
+        idle = sum(s["count"] for s in db.query_stats())  # пустая очередь — ни одного запроса
+
+        run_at = (datetime.now() + timedelta(seconds=1)).replace(microsecond=0) + timedelta(seconds=1)
+        db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, ?)", (did, run_at.strftime("%Y-%m-%d %H:%M:%S")))
+        sched.wake_scheduler()
+        await asyncio.sleep((run_at - datetime.now()).total_seconds() + 0.5)
+        task.cancel()
+        return idle, run_at
+
+    idle, run_at = asyncio.run(go())
+    assert idle == 0
+    assert [d for d, _ in published] == [did]
+    # разбужен вставкой, затем проснулся ровно к run_at, а не на следующем 10-секундном тике
+    assert 0 <= (published[0][1] - run_at).total_seconds() < 0.3
+    assert db.fetchone("SELECT status FROM schedules WHERE draft_id=?", (did,)) == ("done",)
+
+
+def test_due_slots_run_per_channel_in_parallel_and_in_order(sched_module, monkeypatch):
+    import asyncio
+    sched, db = sched_module
+    calls = []
+    in_flight = {}
+    peak = 0
+    both = asyncio.Event()
+
+    async def fake_publish(bot, draft_id, channel_id, schedule_id=None):
+        nonlocal peak
+        calls.append((channel_id, draft_id))
+        in_flight[channel_id] = in_flight.get(channel_id, 0) + 1
+        peak = max(peak, sum(in_flight.values()))
+        if len([c for c, k in in_flight.items() if k]) == 2:
+            both.set()
+        # первая публикация ждёт, пока начнётся публикация во втором канале
+        # (при последовательной обработке каналов выйдем по таймауту с peak == 1)
+        try:
+            await asyncio.wait_for(both.wait(), timeout=2)
+        except asyncio.TimeoutError:
+            pass
+        in_flight[channel_id] -= 1
+        await db.atransaction(sched._mark_published, draft_id, schedule_id)
+        return True
+
+    monkeypatch.setattr(sched, "_publish", fake_publish)
+    order = {}
+    for i in range(6):
+        ch = -1 if i % 2 else None  # None — общий канал
+        did = db.execute("INSERT INTO drafts(author_id, content_type, text, channel_id) VALUES(0, 'text', 'x', ?)", (ch,)).lastrowid
+        db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime','-1 minute', ?))",
+                   (did, f"+{i} seconds"))
+        order.setdefault(ch or -100, []).append(did)
+
+    n, skipped = asyncio.run(sched._run_due(None, -100))
+    assert (n, skipped) == (6, 0)
+    # два канала публикуются одновременно, внутри канала — по одному и по порядку
+    assert peak == 2 and max(in_flight.values()) == 0
+    for ch, dids in order.items():
+        assert [d for c, d in calls if c == ch] == dids
+
+
+def test_failed_slot_retried_with_backoff_then_dead(sched_module, monkeypatch):
+    import asyncio
+    from datetime import datetime
+    from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+    from aiogram.methods import SendMessage
+    sched, db = sched_module
+    method = SendMessage(chat_id=-100, text="x")
+    errors = iter([OSError("network down"), TelegramRetryAfter(method, "flood", 600), OSError("again")])
+
+    async def failing_publish(bot, draft_id, channel_id, schedule_id=None):
+        raise next(errors)
+
+    monkeypatch.setattr(sched, "_publish", failing_publish)
+    monkeypatch.setattr(sched, "PUBLISH_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(sched, "PUBLISH_RETRY_BASE", 30)
+    did = db.execute("INSERT INTO drafts(author_id, content_type, text) VALUES(0, 'text', 'r')").lastrowid
+    sid = db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime','-1 minute'))", (did,)).lastrowid
+
+    def state():
+        status, attempts, err, run_at = db.fetchone("SELECT status, attempts, last_error, run_at FROM schedules WHERE id=?", (sid,))
+        return status, attempts, err, (datetime.strptime(run_at, "%Y-%m-%d %H:%M:%S") - datetime.now()).total_seconds()
+
+    def make_due():
+        db.execute("UPDATE schedules SET run_at=datetime('now','localtime','-1 second') WHERE id=?", (sid,))
+
+    asyncio.run(sched._run_slot(None, sid, did, -100))
+    status, attempts, err, wait = state()
+    assert (status, attempts) == ("pending", 1) and "network down" in err and 25 <= wait <= 31
+
+    make_due()
+    asyncio.run(sched._run_slot(None, sid, did, -100))
+    status, attempts, err, wait = state()
+    assert (status, attempts) == ("pending", 2) and wait >= 595  # retry_after важнее backoff (60с)
+
+    make_due()
+    asyncio.run(sched._run_slot(None, sid, did, -100))
+    assert state()[:2] == ("dead", 3)
+
+    # постоянная ошибка Telegram — сразу dead
+    async def bad_request(bot, draft_id, channel_id, schedule_id=None):
+        raise TelegramBadRequest(method, "chat not found")
+
+    monkeypatch.setattr(sched, "_publish", bad_request)
+    sid2 = db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime'))", (did,)).lastrowid
+    asyncio.run(sched._run_slot(None, sid2, did, -100))
+    assert db.fetchone("SELECT status, attempts FROM schedules WHERE id=?", (sid2,)) == ("dead", 1)
+
+
+def test_slot_lease_is_exclusive_and_recovered(sched_module, monkeypatch):
+    import time
+    sched, db = sched_module
+    db.execute("UPDATE schedules SET status='done' WHERE status IN ('pending','running')")
+    did = db.execute("INSERT INTO drafts(author_id, content_type, text, channel_id) VALUES(0, 'text', 'l', -7)").lastrowid
+    s1 = db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime'))", (did,)).lastrowid
+    s2 = db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime'))", (did,)).lastrowid
+
+    monkeypatch.setattr(sched, "INSTANCE_ID", "a")
+    assert sched.claim_slot(s1, -100)
+    monkeypatch.setattr(sched, "INSTANCE_ID", "b")
+    assert not sched.claim_slot(s1, -100)  # уже захвачен
+    assert not sched.claim_slot(s2, -100)  # канал -7 занят экземпляром "a"
+    assert db.fetchone("SELECT status, lease_owner FROM schedules WHERE id=?", (s1,)) == ("running", "a")
+
+    # "a" упал: после истечения lease слот возвращается в очередь и достаётся "b"
+    assert sched._recover_leases() == 0
+    db.execute("UPDATE schedules SET lease_until=? WHERE id=?", (int(time.time()) - 1, s1))
+    assert sched._recover_leases() == 1
+    assert sched.claim_slot(s1, -100)
+    assert db.fetchone("SELECT status, lease_owner FROM schedules WHERE id=?", (s1,)) == ("running", "b")
+
+    # перезапуск "b" с тем же INSTANCE_ID: свои захваты освобождаются сразу
+    assert sched._recover_leases(own=True) == 1
+    assert db.fetchone("SELECT status, lease_owner FROM schedules WHERE id=?", (s1,)) == ("pending", None)
+
+
+def test_payload_compiled_at_schedule_time_and_invalidated(sched_module, monkeypatch):
+    import asyncio
+    import json
+    from bot.utils.tg_limiter import TelegramLimiter
+    sched, db = sched_module
+    sent = []
+
+    class FakeBot:
+        async def send_message(self, chat_id, text, **kw):
+            sent.append(("message", chat_id, text, kw.get("reply_markup")))
+
+        async def send_photo(self, chat_id, photo, **kw):
+            sent.append(("photo", chat_id, kw.get("caption"), kw.get("reply_markup")))
+
+    monkeypatch.setattr(sched, "limiter", TelegramLimiter(global_rate=1000, group_rate=1000, group_burst=1000))
+    monkeypatch.setattr(sched, "RSS_INCLUDE_LINK", True)
+    buttons = json.dumps([{"text": "Go", "url": "https://example.com"}])
+    did = db.execute(
+        "INSERT INTO drafts(author_id, content_type, text, media_file_id, buttons_json) VALUES(0, 'photo', 'a < b', 'F1', ?)",
+        (buttons,),
+    ).lastrowid
+    db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime','+1 hour'))", (did,))
+    sched.precompile_payload(did)
+    stored = json.loads(db.fetchone("SELECT payload FROM publish_payloads WHERE draft_id=?", (did,))[0])
+    assert stored["steps"] == [{"m": "photo", "file": "F1", "caption": "a &lt; b", "kb": True}]
+
+    # горячий путь: черновик больше не читается
+    def no_compile(draft_id):
+        raise AssertionError("recompiled on publish")
+
+    monkeypatch.setattr(sched, "_compile_payload", no_compile)
+    assert asyncio.run(sched._publish(FakeBot(), did, -100))
+    assert sent[0][:3] == ("photo", -100, "a &lt; b") and sent[0][3].inline_keyboard[0][0].url == "https://example.com"
+    monkeypatch.undo()
+
+    # правка черновика удаляет собранный пост (триггер), смена хвоста — fingerprint
+    db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime','+1 hour'))", (did,))
+    sched.precompile_payload(did)
+    db.execute("UPDATE drafts SET text='new text' WHERE id=?", (did,))
+    assert db.fetchone("SELECT 1 FROM publish_payloads WHERE draft_id=?", (did,)) is None
+    sched.precompile_payload(did)
+    fp = db.fetchone("SELECT fingerprint FROM publish_payloads WHERE draft_id=?", (did,))[0]
+    monkeypatch.setattr(sched, "RSS_INCLUDE_LINK", True)
+    monkeypatch.setattr(sched, "_trailing_values", lambda: ("new text", "Link"))
+    assert sched._tail_fingerprint() != fp
+    payload = asyncio.run(sched._load_payload(did))
+    assert payload["steps"][0]["caption"] == '<a href="new text">Link</a>'
+
+
+def test_retry_resumes_multi_message_post(sched_module, monkeypatch):
+    import asyncio
+    from bot.utils.tg_limiter import TelegramLimiter
+    sched, db = sched_module
+    sent = []
+    fail = {"message": 1}
+
+    class FakeBot:
+        async def send_message(self, chat_id, text, **kw):
+            if fail["message"]:
+                fail["message"] -= 1
+                raise OSError("network down")
+            sent.append("message")
+
+        async def send_photo(self, chat_id, photo, **kw):
+            sent.append("photo")
+
+    monkeypatch.setattr(sched, "limiter", TelegramLimiter(global_rate=1000, group_rate=1000, group_burst=1000))
+    did = db.execute(
+        "INSERT INTO drafts(author_id, content_type, text, media_file_id) VALUES(0, 'photo', ?, 'F2')", ("x" * 2000,)
+    ).lastrowid
+    sid = db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime'))", (did,)).lastrowid
+
+    # фото ушло, текст (второй шаг) — нет: повтор продолжает с текста, фото не дублируется
+    asyncio.run(sched._run_slot(FakeBot(), sid, did, -100))
+    assert sent == ["photo"]
+    assert db.fetchone("SELECT status, sent_steps FROM schedules WHERE id=?", (sid,)) == ("pending", 1)
+    db.execute("UPDATE schedules SET run_at=datetime('now','localtime','-1 second') WHERE id=?", (sid,))
+    asyncio.run(sched._run_slot(FakeBot(), sid, did, -100))
+    assert sent == ["photo", "message"]
+    assert db.fetchone("SELECT status FROM schedules WHERE id=?", (sid,)) == ("done",)
+
+
+def test_lease_renewed_while_publishing(sched_module, monkeypatch):
+    import asyncio
+    import time
+    sched, db = sched_module
+    monkeypatch.setattr(sched, "PUBLISH_LEASE_SEC", 3)
+    recovered = []
+
+    async def slow_publish(bot, draft_id, channel_id, schedule_id=None):
+        # долгое ожидание лимитов: исходный захват истёк бы, но его продлевают
+        db.execute("UPDATE schedules SET lease_until=? WHERE id=?", (int(time.time()) - 1, schedule_id))
+        await asyncio.sleep(1.2)
+        recovered.append(sched._recover_leases())
+        await db.atransaction(sched._mark_published, draft_id, schedule_id)
+        return True
+
+    monkeypatch.setattr(sched, "_publish", slow_publish)
+    did = db.execute("INSERT INTO drafts(author_id, content_type, text) VALUES(0, 'text', 'slow')").lastrowid
+    sid = db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime'))", (did,)).lastrowid
+    assert asyncio.run(sched._run_slot(None, sid, did, -100))
+    assert recovered == [0]
+    assert db.fetchone("SELECT status FROM schedules WHERE id=?", (sid,)) == ("done",)
+
+
+def test_slot_canceled_while_publishing_stays_canceled(sched_module, monkeypatch):
+    import asyncio
+    sched, db = sched_module
+    from bot.handlers.publish_delete import _delete_draft
+
+    async def cancel_then_fail(bot, draft_id, channel_id, schedule_id=None):
+        db.execute("UPDATE schedules SET status='canceled' WHERE id=?", (schedule_id,))
+        raise OSError("network down")
+
+    monkeypatch.setattr(sched, "_publish", cancel_then_fail)
+    did = db.execute("INSERT INTO drafts(author_id, content_type, text) VALUES(0, 'text', 'c')").lastrowid
+    sid = db.execute("INSERT INTO schedules(draft_id, run_at) VALUES(?, datetime('now','localtime'))", (did,)).lastrowid
+    asyncio.run(sched._run_slot(None, sid, did, -100))
+    assert db.fetchone("SELECT status, attempts FROM schedules WHERE id=?", (sid,)) == ("canceled", 0)
+
+    # удаление черновика отменяет и «мёртвый» слот, опубликовать его больше нельзя
+    dead = db.execute("INSERT INTO schedules(draft_id, run_at, status) VALUES(?, datetime('now','localtime'), 'dead')", (did,)).lastrowid
+    sched.precompile_payload(did)
+    with db.transaction():
+        _delete_draft(did)
+    assert db.fetchone("SELECT status FROM schedules WHERE id=?", (dead,)) == ("canceled",)
+    assert sched._compile_payload(did) is None
+    monkeypatch.setattr(sched, "get_channel_id", lambda: -100)
+    assert asyncio.run(sched.publish_now(None, did)) is False
+
+
+def test_manual_publish_failure_keeps_cancel_made_meanwhile(sched_module, monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+    sched, db = sched_module
+    from bot.handlers import queue
+
+    async def cancel_then_fail(bot, draft_id, schedule_id=None):
+        db.execute("UPDATE schedules SET status='canceled' WHERE id=?", (schedule_id,))
+        raise OSError("network down")
+
+    async def answer(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(queue, "publish_now", cancel_then_fail)
+    monkeypatch.setattr(queue, "get_channel_id", lambda: -100)
+    did = db.execute("INSERT INTO drafts(author_id, content_type, text) VALUES(0, 'text', 'm')").lastrowid
+    sid = db.execute("INSERT INTO schedules(draft_id, run_at, status) VALUES(?, datetime('now','localtime'), 'dead')", (did,)).lastrowid
+    cb = SimpleNamespace(
+        data=f"qpub:{sid}", from_user=SimpleNamespace(id=0), answer=answer,
+        message=SimpleNamespace(bot=None, answer=answer),
+    )
+    monkeypatch.setattr(queue, "_is_admin", lambda uid: True)
+    asyncio.run(queue.qpub(cb))
+    assert db.fetchone("SELECT status FROM schedules WHERE id=?", (sid,)) == ("canceled",)